@@ -0,0 +1,495 @@
+"""Dashboard computations, callable without Streamlit.
+
+``load_dataset()`` reads the processed store once and every view function
+takes that dataset and returns a dict of named tables and figures. Views
+read lender rows only through ``fact_rows()``, ``fact_sums()`` and
+``fact_pivot()``, which run against the in-memory fact table or, with the
+out-of-core store, push the filter and group-by down to the lake scan. The app
+renders the dicts; ``write_report()`` writes them all to disk, each table as
+CSV or Parquet and each figure as a standalone HTML page, building the views
+concurrently on threads that share the one loaded dataset.
+
+    python analytics.py reports/ --format parquet
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import plotly.express as px
+
+import lake
+from coinvest import EXCLUDED_CATEGORIES, build_coinvestment, colending, pairs_coinvestment
+from cube import SUNBURST_DIMS, cube_pivot, rolling_cube, select
+from hierarchy import TOP, hierarchy_figure
+from ingest import PERIOD, memory_mb, read_source
+from lenderindex import build_index, canonical_name, lender_rows
+from profiling import stage
+from segmentation import (DIMENSIONS, ELBOW_METHODS, SILHOUETTE_SAMPLE, TICKET_EDGES, cluster_investors, elbow_curve,
+                          feature_matrix, reduce_features)
+from store import STORE_DIR, dataset_key, ensure_store, lake_dir, load_store, read_manifest
+
+SEGMENT_INVESTORS = ['Asset Manager', 'Insurance', 'Pension Fund']
+SEGMENT_DIMENSIONS = ['Sector', 'Ticket size']
+CLUSTERS = 4
+
+# Lender whose tickets the deal comparison sets against the market; any name or alias
+BENCHMARK = 'NORD/LB'
+
+
+def fact_rows(data, where=None, columns=None, funded=False):
+    """Lender rows matching ``where`` (dimension -> value or list), funded only if asked."""
+    if data['lake']:
+        return lake.rows(data['lake'], where, columns, funded)
+    df = select(data['lenders'], where)
+    if funded:
+        df = df[df['valueEUR'] > 0]
+    return df if columns is None else df[columns]
+
+
+def fact_sums(data, by, value='valueEUR', where=None, funded=False):
+    """``value`` summed per combination of ``by``, missing keys kept."""
+    if data['lake']:
+        return lake.sums(data['lake'], by, value, where, funded)
+    df = fact_rows(data, where, funded=funded)
+    return df.groupby(by, observed=True, dropna=False, sort=False)[value].sum().reset_index()
+
+
+def path_sums(data, path, top):
+    """Funded sums over a hierarchy path; out of core, only the ``top`` leaves per parent leave DuckDB."""
+    if data['lake']:
+        return lake.top_sums(data['lake'], path, top, funded=True)
+    return fact_sums(data, path, funded=True)
+
+
+def fact_pivot(data, index, values, aggfunc, where=None, funded=False):
+    """``pd.pivot_table()`` of the matching lender rows."""
+    if data['lake']:
+        return lake.pivot(data['lake'], index, values, aggfunc, where, funded)
+    df = fact_rows(data, where, funded=funded)
+    return pd.pivot_table(df, values=values, index=index, aggfunc=aggfunc, observed=True)
+
+
+def lender_facts(data, lender):
+    """All rows of one lender, looked up by name or alias."""
+    if data['lake']:
+        name = canonical_name(data['lenderindex'], lender)
+        return fact_rows(data, {'name': [] if name is None else name})
+    return data['lenders'].take(lender_rows(data['lenderindex'], lender))
+
+
+def deal_summary(dealdf):
+    """Deals per category and how many of them have an institutional lender."""
+    df = pd.DataFrame({'Deal Category': dealdf['Deal Category'], 'deals': 1,
+                       'instodeals': (dealdf['Insto lenders'] > 0).astype(int)})
+    return df.groupby('Deal Category', observed=True, dropna=False, as_index=False).sum()
+
+
+def load_dataset(store_dir=STORE_DIR):
+    """Store tables plus the derived frames the views share."""
+    with stage('read store'):
+        # One manifest for both, so the tables are those of the version it names
+        manifest = read_manifest(store_dir)
+        tables = load_store(store_dir, manifest)
+    lakedir = lake_dir(store_dir, manifest)
+    lenderdf = tables.get('lenders')
+    marketcube = tables['marketcube']
+    lendercube = tables['lendercube']
+    data = {'lenders': lenderdf, 'lake': lakedir, 'deals': tables.get('deals'), 'marketcube': marketcube,
+            'lendercube': lendercube, 'periodcube': tables['periodcube'], 'rollingcube': rolling_cube(tables['periodcube'])}
+
+    allocationdf = cube_pivot(marketcube, ['dominantSector', 'Bank / Insto'])
+    allocationdf.reset_index(inplace=True)
+    allocationdf['Percent'] = 100 * allocationdf['valueEUR'] / allocationdf.groupby('Bank / Insto', observed=True)['valueEUR'].transform('sum')
+
+    marketsunburstvol = cube_pivot(tables['sunburst'], SUNBURST_DIMS)
+    marketsunburstvol.reset_index(inplace=True)
+
+    with stage('deal summary'):
+        dealsummary = lake.deal_summary(lakedir) if lakedir else deal_summary(data['deals'])
+    with stage('coinvestment index'):
+        if lakedir:
+            # Only the pair counts leave DuckDB, not the rows of every mixed deal
+            coinvestment = pairs_coinvestment(lake.colending_pairs(lakedir, EXCLUDED_CATEGORIES))
+        else:
+            coinvestment = build_coinvestment(fact_rows(data, {'Deal Category': 'Mixed'}, [
+                'name', 'Deal name', 'Deal Category', 'Bank / Insto', 'Categories', 'dominantSector', 'valueEUR']))
+    uniquelenders = read_source('lenders')
+    with stage('lender index'):
+        lenderindex = build_index(lenderdf, uniquelenders, present=lendercube['name'].unique())
+
+    if lakedir:
+        instolist = lendercube.loc[lendercube['Bank / Insto']=='Insto','name'].unique().tolist()
+        memory = {'Largest chunk before (MB)': manifest['memory_before_mb'], 'Lake on disk (MB)': lake.size_mb(lakedir),
+                  'Cubes (MB)': sum(memory_mb(tables[name]) for name in tables)}
+    else:
+        instolist = lenderdf[lenderdf['Bank / Insto']=='Insto']['name'].unique().tolist()
+        memory = {'Lender rows before (MB)': manifest['memory_before_mb'], 'Lender rows after (MB)': memory_mb(lenderdf)}
+
+    data.update({
+        'allocation': allocationdf,
+        'sunburst': marketsunburstvol,
+        'dealsummary': dealsummary,
+        'coinvestment': coinvestment,
+        'lenderindex': lenderindex,
+        'instolist': instolist,
+        'uniquelenders': uniquelenders,
+        'countriesregions': read_source('countries'),
+        'info': {'memory': memory, 'version': manifest['version'], 'key': dataset_key(manifest),
+                 'deltas': manifest['deltas'], 'backend': manifest.get('backend', 'pandas'),
+                 'quality': manifest['quality']},
+    })
+    return data
+
+
+def data_quality(data):
+    """The export's quality report as tables: totals, unmatched lenders, unknown countries."""
+    report = data['info']['quality']
+    view = {'summary': pd.DataFrame({'Value': {key: value for key, value in report.items()
+                                               if not isinstance(value, list)}})}
+    view['unmatchedlenders'] = pd.DataFrame(report['top unmatched lenders'], columns=['name', 'rows', 'valueEUR'])
+    view['unknowncountries'] = pd.DataFrame(report['top unknown countries'], columns=['country', 'deals'])
+    view['zerovaluedeals'] = pd.DataFrame({'Deal name': report['zero-value examples']})
+    return view
+
+
+def market_stats(data):
+    view = {}
+    marketcube, deals, allocationdf = data['marketcube'], data['dealsummary'], data['allocation']
+
+    df = cube_pivot(marketcube,'Bank / Insto')
+    df['Pct']=df['valueEUR']*100/df['valueEUR'].sum()
+    insto = df.loc['Insto'] if 'Insto' in df.index else pd.Series({'valueEUR': 0.0, 'Pct': 0.0})
+    df.reset_index(inplace=True)
+    view['split'] = df
+
+    view['headline'] = pd.DataFrame({'Value': {
+        'Total market size bn EUR': df['valueEUR'].sum()/1000,
+        'Institutional share of market': insto['Pct'],
+        'Total Insto market size bn EUR': insto['valueEUR']/1000,
+        'Deals with instos': int(deals['instodeals'].sum()),
+        'Total deals': int(deals['deals'].sum()),
+    }})
+
+    df = cube_pivot(marketcube,'Deal Category')
+    df['Deal number'] = deals.dropna(subset=['Deal Category']).set_index('Deal Category')['deals'].rename(index=str)
+    df['Average deal size mEUR']= df['valueEUR']/df['Deal number']
+    df.reset_index(inplace=True)
+    view['categories'] = df
+
+    view['sunburst'] = hierarchy_figure('sunburst',data['sunburst'],['Deal Category','dominantSector','dominantCountry'])
+    view['dealcount'] = px.bar(df,x=['Deal number','Average deal size mEUR'],y='Deal Category',barmode='group',labels={'x':'Average deal size mEUR / Deal count','y':'Deal Category'})
+
+    # fig = px.line_polar(allocationdf,r='valueEUR',theta='dominantSector',color='Insto investor')
+    fig = px.bar(allocationdf,x='valueEUR',y='dominantSector',color='Bank / Insto')
+    fig.update_layout(yaxis={'categoryorder':'total ascending'})
+    view['volume'] = fig
+
+    view['allocation'] = px.line_polar(allocationdf,r='Percent',theta='dominantSector',color='Bank / Insto')
+    view['allocationdata'] = allocationdf
+
+    alldeals = cube_pivot(marketcube,'dominantSector',columns='Bank / Insto',aggfunc='mean',where={'positive':True})
+    fig = px.bar(alldeals,x=['Bank','Insto'],barmode='group')
+    fig.update_layout(yaxis={'categoryorder':'total ascending'})
+    view['tickets'] = fig
+    return view
+
+
+def sector_bar(df, **kwargs):
+    fig = px.bar(df, **kwargs)
+    fig.update_layout(xaxis={'categoryorder':'total descending'})
+    return fig
+
+
+def stage_shares(df):
+    df = df[['Greenfield', 'Additional Financing', 'Refinancing']]
+    df = df.div(df.sum(axis=1), axis=0)
+    fig = px.imshow(df.transpose(), text_auto='.2%', color_continuous_scale='greens')
+    fig.update(layout_coloraxis_showscale=False)
+    return fig
+
+
+def investor_deals(data, lender):
+    """Funded lender rows of one investor, looked up by name or alias."""
+    df = lender_facts(data, lender)
+    return df[df['valueEUR'] > 0]
+
+
+def benchmark_comparison(data, benchmark=BENCHMARK):
+    """Average tickets of ``benchmark`` vs the market on bank only and mixed deals."""
+    view = {}
+    marketcube, lendercube = data['marketcube'], data['lendercube']
+    name = canonical_name(data['lenderindex'], benchmark)
+    if name is None:
+        raise ValueError('Unknown benchmark lender: {}'.format(benchmark))
+    rows = lender_facts(data, benchmark)
+
+    for category, key in [('Bank only', 'bank'), ('Mixed', 'mixed')]:
+        df = cube_pivot(marketcube,'dominantSector',aggfunc='mean',where={'Deal Category':category})
+        benchdf = cube_pivot(lendercube,'dominantSector',aggfunc='mean',where={'Deal Category':category,'name':name})
+        df = df.merge(benchdf,left_index=True,right_index=True)
+        df.columns=['Market average ticket','{} average ticket'.format(name)]
+        view[key+'tickets'] = sector_bar(df,barmode='group')
+        view[key+'benchmark'] = rows[rows['Deal Category'] == category]
+    return view
+
+
+def deal_comparison(data, benchmark=BENCHMARK):
+    """Bank only vs insto only vs mixed deals, plus the benchmark lender unless it is None."""
+    view = {}
+    marketcube = data['marketcube']
+
+    view['bankvolume'] = sector_bar(cube_pivot(marketcube,'dominantSector',where={'Deal Category':'Bank only'}))
+    if benchmark is not None:
+        view.update(benchmark_comparison(data, benchmark))
+
+    view['instovolume'] = sector_bar(cube_pivot(marketcube,'dominantSector',columns='Categories',where={'Deal Category':'Insto only'}))
+    view['instotickets'] = sector_bar(cube_pivot(marketcube,'dominantSector',aggfunc='mean',where={'Deal Category':'Insto only'}))
+
+    view['mixedvolume'] = sector_bar(cube_pivot(marketcube,'dominantSector',columns='Categories',where={'Deal Category':'Mixed'}))
+    view['stagebysector'] = stage_shares(cube_pivot(marketcube,'dominantSector',columns='details.transactionType',where={'Deal Category':'Mixed'}))
+    view['stagebytype'] = stage_shares(cube_pivot(marketcube,'Categories',columns='details.transactionType',where={'Deal Category':'Mixed'}))
+
+    df = cube_pivot(marketcube,'dominantSector',columns='Categories',aggfunc='mean',where={'Deal Category':'Mixed'})
+    view['mixedtypetickets'] = px.bar(df,barmode='group')
+    view['mixedtypedata'] = df
+    return view
+
+
+def investor_tickets(data, bysector=False):
+    """Ticket count, sum, mean and median per institutional investor."""
+    index = ['name', 'dominantSector'] if bysector else 'name'
+    return fact_pivot(data,index,'valueEUR',['count','sum','mean','median'],where={'Bank / Insto':'Insto'},funded=True)
+
+
+def market_participants(data, top=TOP):
+    view = {}
+    lendercube = data['lendercube']
+
+    # Summed per path level with the top lenders/deals per parent, the rest folded into 'Other'
+    paths = [
+        ['Deal Category','Bank / Insto', 'dominantSector', 'Categories','name', 'Deal name'],
+        ['Deal Category', 'Bank / Insto','Categories','name', 'dominantSector', 'Deal name'],
+        ['dominantSector', 'Deal Category','Categories', 'name', 'Deal name'],
+    ]
+    with stage('treemaps'):
+        view['treemaps'] = [hierarchy_figure('treemap', path_sums(data, path, top), path, color='name', top=top)
+                            for path in paths]
+
+    mixeddf = cube_pivot(lendercube,'name',columns='dominantSector',aggfunc='count',where={'Bank / Insto':'Bank','Deal Category':'Mixed'})
+    df = cube_pivot(lendercube,'name',columns='dominantSector',aggfunc='count',where={'Bank / Insto':'Bank'})
+
+    #min 10 deals per bank
+    df = df[(df>10)]
+
+    df = mixeddf.div(df)
+    df.dropna(how='all', inplace=True)
+    view['mixedshare'] = df
+
+    view['colending'] = {sector: colending(data['coinvestment'], sector) for sector in sorted(data['coinvestment']['sectors'])}
+    view['investortickets'] = investor_tickets(data)
+    view['investorsectortickets'] = investor_tickets(data, bysector=True)
+    view['instodeals'] = fact_pivot(data,['dominantSector'],'summary.debtsizeEUR',['count','mean','median'],where={'Bank / Insto':'Insto'},funded=True)
+    return view
+
+
+def quarters(data):
+    """Close quarters with deals, oldest first, as '2021Q1' labels."""
+    return [str(q) for q in pd.PeriodIndex(data['periodcube'][PERIOD].dropna().unique(), freq='Q').sort_values()]
+
+
+def _quarter(label):
+    return pd.Period(label, freq='Q').start_time
+
+
+def _period_table(cube):
+    """Volume, institutional share and average funded tickets per quarter of ``cube``."""
+    volume = cube_pivot(cube, PERIOD, columns='Bank / Insto').reindex(columns=['Bank', 'Insto'], fill_value=0)
+    tickets = cube_pivot(cube, PERIOD, columns='Bank / Insto', aggfunc='mean', where={'positive': True})
+    tickets = tickets.reindex(index=volume.index, columns=['Bank', 'Insto'])
+    total = volume.sum(axis=1)
+    return pd.DataFrame({
+        'Volume mEUR': total,
+        'Institutional share': volume['Insto'] * 100 / total,
+        'Average bank ticket mEUR': tickets['Bank'],
+        'Average insto ticket mEUR': tickets['Insto'],
+    })
+
+
+def time_periods(data, start=None, end=None):
+    """Quarterly and trailing 12-month metrics for the quarters from ``start`` to ``end``.
+
+    Both ends are quarter labels or dates, inclusive. Everything is sliced
+    from the period cubes; a trailing window is selected by its last quarter.
+    """
+    view = {}
+    frames = {}
+    for name in ['periodcube', 'rollingcube']:
+        cube = data[name]
+        mask = cube[PERIOD].notna()
+        if start is not None:
+            mask &= cube[PERIOD] >= _quarter(start)
+        if end is not None:
+            mask &= cube[PERIOD] <= _quarter(end)
+        frames[name] = cube[mask]
+
+    view['quarterly'] = _period_table(frames['periodcube'])
+    view['rolling'] = _period_table(frames['rollingcube'])
+    df = pd.concat({'Quarter': view['quarterly'], 'Trailing 12 months': view['rolling']}, names=['Window']).reset_index()
+    view['share'] = px.line(df, x=PERIOD, y='Institutional share', color='Window', markers=True)
+    view['tickets'] = px.line(df, x=PERIOD, y=['Average bank ticket mEUR', 'Average insto ticket mEUR'],
+                              line_dash='Window', labels={'value': 'Average ticket mEUR', 'variable': ''})
+
+    # Share of each lender type's volume over the whole range going to each sector
+    df = cube_pivot(frames['periodcube'], 'dominantSector', columns='Bank / Insto').reindex(columns=['Bank', 'Insto'])
+    df = df * 100 / df.sum()
+    view['allocationdata'] = df
+    view['allocation'] = px.bar(df, barmode='group', labels={'value': 'Percent of volume', 'Bank / Insto': ''})
+    return view
+
+
+def segment_features(data, investorcat, dimensions, mindeals, ticketedges=TICKET_EDGES, ticketquantiles=None):
+    """``feature_matrix()`` fed only the funded tickets it can use."""
+    df = fact_rows(data, {'Categories': list(investorcat), 'Deal Category': ['Insto only', 'Mixed']},
+                   ['name', 'valueEUR', 'Categories', 'Deal Category', 'dominantSector', 'dominantCountry',
+                    'details.transactionType'], funded=True)
+    return feature_matrix(df, investorcat, dimensions, mindeals, ticketedges, ticketquantiles)
+
+
+def elbow_figure(wcss):
+    return px.line(x=range(1,len(wcss)+1),y=wcss,title='Optimal number of clusters')
+
+
+def assign_clusters(features, k, components=None):
+    """``features`` with a Clusters column from the (persisted) KMeans fit."""
+    return features.assign(Clusters=cluster_investors(features, k, components)['labels'])
+
+
+def cluster_figure(summary):
+    fig = px.imshow(summary, text_auto='.2%', color_continuous_scale='greens')
+    fig.update_yaxes(tick0=0,dtick=1)
+    fig.update(layout_coloraxis_showscale=False)
+    return fig
+
+
+def segmentation(data, investorcat=SEGMENT_INVESTORS, dimensions=SEGMENT_DIMENSIONS, k=CLUSTERS, mindeals=2,
+                 elbowmethod='KMeans', ticketedges=TICKET_EDGES, ticketquantiles=None, components=None):
+    view = {}
+    features = segment_features(data, investorcat, dimensions, mindeals, ticketedges, ticketquantiles)
+    X, _ = reduce_features(features, components)
+    view['elbow'] = elbow_figure(elbow_curve(X, method=elbowmethod))
+
+    clusters = cluster_investors(features, k, components)
+    view['fit'] = pd.DataFrame({'Value': {
+        'Investors': len(features),
+        'Features': features.shape[1],
+        'Dimensions clustered': X.shape[1],
+        'Silhouette (sample of {:,})'.format(SILHOUETTE_SAMPLE): clusters['silhouette'],
+    }})
+    df = features.assign(Clusters=clusters['labels'])
+    summary = df.groupby('Clusters').mean()
+    view['clusters'] = cluster_figure(summary)
+    view['clustersummary'] = summary
+    view['segments'] = df
+    return view
+
+
+VIEWS = {
+    'market_stats': market_stats,
+    'deal_comparison': deal_comparison,
+    'market_participants': market_participants,
+    'segmentation': segmentation,
+    'time_periods': time_periods,
+    'data_quality': data_quality,
+}
+
+
+def _artefacts(view, prefix=''):
+    # Flatten lists and dicts of results into (file stem, table or figure)
+    for key, item in view.items():
+        stem = prefix + str(key).replace('/', '-')
+        if isinstance(item, dict):
+            yield from _artefacts(item, stem + '_')
+        elif isinstance(item, list):
+            yield from _artefacts({i + 1: part for i, part in enumerate(item)}, stem + '_')
+        else:
+            yield stem, item
+
+
+def _flat(df):
+    # Parquet wants string column names: pivot tables come with MultiIndex ones
+    df = df.copy()
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = [' '.join(map(str, col)) for col in df.columns]
+    else:
+        df.columns = df.columns.map(str)
+    return df
+
+
+def _write_view(name, func, data, outdir, fmt, options):
+    start = time.perf_counter()
+    viewdir = os.path.join(outdir, name)
+    os.makedirs(viewdir, exist_ok=True)
+    written = []
+    for stem, item in _artefacts(func(data, **options.get(name, {}))):
+        if isinstance(item, pd.DataFrame):
+            path = os.path.join(viewdir, stem + '.' + fmt)
+            if fmt == 'parquet':
+                _flat(item).to_parquet(path)
+            else:
+                _flat(item).to_csv(path)
+        else:
+            path = os.path.join(viewdir, stem + '.html')
+            item.write_html(path, include_plotlyjs='cdn')
+        written.append(path)
+    return written, time.perf_counter() - start
+
+
+def write_report(outdir, fmt='csv', views=None, workers=None, store_dir=STORE_DIR, options=None):
+    """Write every table and figure of ``views`` (all by default) under ``outdir``.
+
+    ``options`` maps a view name to keyword arguments for its function, e.g.
+    ``{'segmentation': {'k': 5}}``. Returns ``{view: (paths, seconds)}``.
+    """
+    if fmt not in ('csv', 'parquet'):
+        raise ValueError('Unknown table format: {}'.format(fmt))
+    ensure_store(store_dir)
+    data = load_dataset(store_dir)
+    views = views or list(VIEWS)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {name: pool.submit(_write_view, name, VIEWS[name], data, outdir, fmt, options or {}) for name in views}
+        return {name: future.result() for name, future in futures.items()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write every dashboard table and figure to a directory.')
+    parser.add_argument('outdir')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help='table format')
+    parser.add_argument('--views', nargs='+', choices=list(VIEWS), help='default: all views')
+    parser.add_argument('--workers', type=int, help='views built concurrently')
+    parser.add_argument('--benchmark', default=BENCHMARK, help='lender compared with the market in deal_comparison')
+    parser.add_argument('--top', type=int, default=TOP, help='largest items per parent in the treemaps')
+    parser.add_argument('--investors', nargs='+', default=SEGMENT_INVESTORS, help='segmentation investor categories')
+    parser.add_argument('--dimensions', nargs='+', choices=DIMENSIONS, default=SEGMENT_DIMENSIONS)
+    parser.add_argument('--clusters', type=int, default=CLUSTERS)
+    parser.add_argument('--mindeals', type=int, default=2)
+    parser.add_argument('--elbow', choices=ELBOW_METHODS, default='KMeans', help='elbow curve method')
+    parser.add_argument('--components', type=int, help='cluster on this many principal components')
+    parser.add_argument('--ticket-edges', type=float, nargs='+', default=TICKET_EDGES, help='ticket bucket edges in mEUR')
+    parser.add_argument('--ticket-quantiles', type=int, help='quantile ticket buckets instead of fixed edges')
+    parser.add_argument('--since', help='first close quarter of time_periods, e.g. 2022Q1')
+    parser.add_argument('--until', help='last close quarter of time_periods')
+    args = parser.parse_args()
+
+    options = {
+        'deal_comparison': {'benchmark': args.benchmark},
+        'market_participants': {'top': args.top},
+        'segmentation': {'investorcat': args.investors, 'dimensions': args.dimensions, 'k': args.clusters,
+                         'mindeals': args.mindeals, 'elbowmethod': args.elbow, 'ticketedges': args.ticket_edges,
+                         'ticketquantiles': args.ticket_quantiles, 'components': args.components},
+        'time_periods': {'start': args.since, 'end': args.until},
+    }
+    for name, (paths, seconds) in write_report(args.outdir, args.format, args.views, args.workers, options=options).items():
+        print('{}: {} files in {:.1f}s'.format(name, len(paths), seconds))
@@ -0,0 +1,47 @@
+"""Excel vs columnar-cache load time for the deal workbook.
+
+    python benchmarks/bench_ingest.py [lender rows ...]
+
+Defaults to 10k, 100k and 1M exploded lender rows. Workbooks are written to a
+temporary directory; the 1M case takes several minutes just to generate.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest  # noqa: E402
+from synthetic import write_workbook  # noqa: E402
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main(sizes):
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            path = os.path.join(tmp, 'deals_{}.xlsx'.format(size))
+            cache_dir = os.path.join(tmp, 'cache_{}'.format(size))
+            write_workbook(path, size)
+
+            excel = timed(pd.read_excel, path)
+            convert = timed(ingest.convert_source, 'deals', path, cache_dir)
+            columnar = timed(ingest.read_source, 'deals', path, cache_dir)
+            rows.append({'lender rows': size, 'excel s': excel, 'convert s': convert,
+                         'columnar s': columnar, 'speedup': excel / columnar})
+            print(rows[-1], flush=True)
+
+    print(pd.DataFrame(rows).to_string(index=False, float_format='{:.3f}'.format))
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
@@ -0,0 +1,55 @@
+"""Lender explode: literal_eval + apply(pd.Series) vs ingest.normalise_lenders.
+
+    python benchmarks/bench_lenders.py [lender rows ...]
+
+Defaults to 1M exploded lender rows. Also checks both paths give the same
+lender table.
+"""
+
+import os
+import sys
+import time
+from ast import literal_eval
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingest import normalise_lenders  # noqa: E402
+from synthetic import make_deals  # noqa: E402
+
+
+def explode_apply(bigdf):
+    """The get_data() code this replaces."""
+    bigdf = bigdf.copy()
+    bigdf['lendersFundingValues'] = bigdf['lendersFundingValues'].apply(literal_eval)
+    lenderdf = pd.DataFrame(bigdf.pop('lendersFundingValues').explode())
+    lenderdf = pd.concat([lenderdf, lenderdf['lendersFundingValues'].apply(pd.Series)], axis=1)
+    return bigdf.join(lenderdf)
+
+
+def explode_bulk(bigdf):
+    lenderdf = normalise_lenders(bigdf)
+    return bigdf.drop(columns='lendersFundingValues').join(lenderdf)
+
+
+def main(sizes):
+    for size in sizes:
+        bigdf = make_deals(size)
+        timings = {}
+        for fn in (explode_apply, explode_bulk):
+            start = time.perf_counter()
+            out = fn(bigdf)
+            timings[fn.__name__] = time.perf_counter() - start
+            if fn is explode_apply:
+                expected = out
+
+        cols = ['Deal name', 'name', 'valueEUR']
+        pd.testing.assert_frame_equal(out[cols].astype({'name': object}), expected[cols].astype({'valueEUR': float}))
+        print('{:,} lender rows: apply {:.2f}s, bulk {:.2f}s ({:.1f}x)'.format(
+            len(out), timings['explode_apply'], timings['explode_bulk'],
+            timings['explode_apply'] / timings['explode_bulk']))
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or [1_000_000])
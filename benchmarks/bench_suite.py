@@ -0,0 +1,143 @@
+"""End-to-end scaling benchmark: ingest, each view and the clustering.
+
+    python benchmarks/bench_suite.py [--scales 1 10 100] [--rows 20000] [--backend pandas]
+
+For each scale a synthetic dataset of ``scale * rows`` exploded lender rows
+(and ``scale * lenders`` classified lenders) is written to a temporary
+directory, which becomes the working directory so the app's default source
+paths and store apply. Every stage is timed and its peak traced allocation
+recorded; tracemalloc slows pure-Python code somewhat, so compare timings
+between runs of this script rather than with the app.
+
+Results are appended to ``benchmarks/results.jsonl`` with the commit they ran
+on, and each stage is compared with its latest earlier run at the same scale.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+import plotly.express as px
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+import analytics  # noqa: E402
+import store  # noqa: E402
+from segmentation import DIMENSIONS, elbow_curve  # noqa: E402
+from synthetic import write_dataset  # noqa: E402
+
+RESULTS = os.path.join(HERE, 'results.jsonl')
+
+# About today's export: 2,500 deals over the 401 classified lenders
+BASE_ROWS = 20_000
+BASE_LENDERS = 401
+
+# A stage this much slower than in the previous run is flagged
+REGRESSION = 1.2
+
+
+def measure(stage, fn, *args, **kwargs):
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    out = fn(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - before
+    print('  {:<22} {:8.2f}s {:9.1f} MB'.format(stage, seconds, peak / 2**20), flush=True)
+    return out, {'stage': stage, 'seconds': seconds, 'peak MB': peak / 2**20}
+
+
+def run_scale(rows, lenders, backend='pandas', seed=0):
+    stages = []
+    data = None
+
+    def step(stage, fn, *args, **kwargs):
+        out, record = measure(stage, fn, *args, **kwargs)
+        stages.append(record)
+        return out
+
+    segment = {'investorcat': analytics.SEGMENT_INVESTORS, 'dimensions': DIMENSIONS, 'mindeals': 2}
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            write_dataset(tmp, rows, lenders, seed)
+            # plotly loads its validators on first use, which would land on the first view
+            px.bar(x=[0], y=[0]).to_dict()
+            tracemalloc.start()
+            step('ingest', store.build_store, backend=backend)
+            data = step('load', analytics.load_dataset)
+            for name in ['market_stats', 'deal_comparison', 'market_participants']:
+                step(name, analytics.VIEWS[name], data)
+            features = step('segmentation features', analytics.segment_features, data, **segment)
+            step('elbow KMeans', elbow_curve, features)
+            step('elbow MiniBatchKMeans', elbow_curve, features, method='MiniBatchKMeans')
+            step('clustering', analytics.assign_clusters, features, analytics.CLUSTERS)
+        finally:
+            tracemalloc.stop()
+            os.chdir(cwd)
+    factrows = len(analytics.fact_rows(data, columns=['deal_id']))
+    return stages, factrows
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_results(path):
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    with open(path) as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+def main(scales, rows, lenders, results, backend='pandas'):
+    run = {'run': datetime.datetime.now().isoformat(timespec='seconds'), 'commit': commit(), 'backend': backend}
+    records = []
+    for scale in scales:
+        print('{}x: {:,} lender rows, {:,} lenders'.format(scale, rows * scale, lenders * scale), flush=True)
+        stages, factrows = run_scale(rows * scale, lenders * scale, backend)
+        records += [dict(run, scale=scale, **{'fact rows': factrows}, **record) for record in stages]
+
+    current = pd.DataFrame(records)
+    history = previous_results(results)
+    if len(history):
+        # Runs from before the backend option used pandas
+        history['backend'] = history.get('backend', pd.Series(index=history.index, dtype=object)).fillna('pandas')
+        keys = ['backend', 'scale', 'stage']
+        last = history.sort_values('run').groupby(keys, as_index=False).last()[keys + ['seconds']]
+        current = current.merge(last, on=keys, how='left', suffixes=('', ' before'))
+        current['ratio'] = current['seconds'] / current['seconds before']
+        current['regression'] = current['ratio'] > REGRESSION
+
+    with open(results, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+    columns = [col for col in ['scale', 'stage', 'seconds', 'peak MB', 'seconds before', 'ratio', 'regression']
+               if col in current]
+    print(current[columns].to_string(index=False, float_format='{:.2f}'.format))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time ingest, the dashboard views and clustering at several scales.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100], help='multiples of today\'s volume')
+    parser.add_argument('--rows', type=int, default=BASE_ROWS, help='exploded lender rows at 1x')
+    parser.add_argument('--lenders', type=int, default=BASE_LENDERS, help='classified lenders at 1x')
+    parser.add_argument('--backend', choices=store.BACKENDS, default='pandas')
+    parser.add_argument('--results', default=RESULTS)
+    args = parser.parse_args()
+    main(args.scales, args.rows, args.lenders, args.results, args.backend)
@@ -0,0 +1,114 @@
+"""Synthetic Inframation-style dataset for benchmarking.
+
+Produces frames shaped like ``deals_insto_europe.xlsx``: one row per deal,
+with the lender tickets serialized as a Python-literal list of dicts in
+``lendersFundingValues``. Lender names are drawn from a lender classification
+table, the real one by default, so the generated deals survive the merge in
+``get_data()``. ``make_lenders()`` grows or shrinks that table to any size.
+
+    python benchmarks/synthetic.py OUTDIR --rows 200000 --lenders 4000
+"""
+
+import argparse
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SECTORS = ['Renewables', 'Telecommunications', 'Transport', 'Power', 'Social Infrastructure',
+           'Oil & Gas', 'Water', 'Mining']
+COUNTRIES = ['United Kingdom', 'France', 'Germany', 'Spain', 'Italy', 'Netherlands', 'Sweden',
+             'Poland', 'Portugal', 'Ireland']
+TRANSACTION_TYPES = ['Greenfield', 'Additional Financing', 'Refinancing', 'Acquisition']
+
+# Financial close dates are spread over this span
+FIRST_CLOSE, LAST_CLOSE = '2021-01-01', '2024-12-31'
+
+LENDERS_PER_DEAL = 8
+
+
+LENDERS_FILE = 'uniquelenders_classified_for_upload.xlsx'
+COUNTRIES_FILE = 'uniquecountries.xlsx'
+DEALS_FILE = 'deals_insto_europe.xlsx'
+
+
+def lender_names():
+    path = os.path.join(ROOT, LENDERS_FILE)
+    return pd.read_excel(path)['Name'].tolist()
+
+
+def make_lenders(nlenders=None, seed=0):
+    """Lender classification table with ``nlenders`` rows.
+
+    Starts from the real classified lenders. A smaller table is a sample of
+    them; a larger one adds synthetic lenders whose Bank / Insto and category
+    follow the real mix.
+    """
+    real = pd.read_excel(os.path.join(ROOT, LENDERS_FILE))
+    if nlenders is None or nlenders == len(real):
+        return real
+    if nlenders < len(real):
+        df = real.sample(nlenders, random_state=seed)
+    else:
+        extra = real.sample(nlenders - len(real), replace=True, random_state=seed)
+        extra['Name'] = ['Synthetic lender {:06d}'.format(i) for i in range(len(extra))]
+        df = pd.concat([real, extra])
+    return df.reset_index(drop=True).assign(ID=range(len(df)))
+
+
+def make_deals(lender_rows, seed=0, names=None):
+    """Return a deals frame whose lender lists explode to about ``lender_rows`` rows."""
+    rng = np.random.default_rng(seed)
+    names = np.asarray(names if names is not None else lender_names(), dtype=object)
+    ndeals = max(1, lender_rows // LENDERS_PER_DEAL)
+
+    counts = rng.integers(1, 2 * LENDERS_PER_DEAL, ndeals)
+    tickets = rng.lognormal(3.5, 1.0, counts.sum()).round(2)
+    lenders = names[rng.integers(0, len(names), counts.sum())]
+    bounds = np.concatenate([[0], counts.cumsum()])
+
+    # Plain Python values so repr() gives literals rather than np.float64(...)
+    ticketlist, lenderlist = tickets.tolist(), lenders.tolist()
+    funding = [repr([{'name': lenderlist[j], 'valueEUR': ticketlist[j]} for j in range(bounds[i], bounds[i + 1])])
+               for i in range(ndeals)]
+
+    return pd.DataFrame({
+        'Deal name': ['Deal {:07d}'.format(i) for i in range(ndeals)],
+        'dominantSector': rng.choice(SECTORS, ndeals),
+        'dominantCountry': rng.choice(COUNTRIES, ndeals),
+        'details.transactionType': rng.choice(TRANSACTION_TYPES, ndeals),
+        'summary.debtsizeEUR': np.add.reduceat(tickets, bounds[:-1]).round(2),
+        'details.financialCloseDate': pd.to_datetime(rng.integers(pd.Timestamp(FIRST_CLOSE).value // 10**9,
+                                                                  pd.Timestamp(LAST_CLOSE).value // 10**9, ndeals), unit='s').normalize(),
+        'lendersFundingValues': funding,
+    })
+
+
+def write_workbook(path, lender_rows, seed=0, names=None):
+    df = make_deals(lender_rows, seed, names)
+    df.to_excel(path, index=False)
+    return df
+
+
+def write_dataset(directory, lender_rows, nlenders=None, seed=0):
+    """The three source workbooks under the names the app reads them from."""
+    os.makedirs(directory, exist_ok=True)
+    lenders = make_lenders(nlenders, seed)
+    lenders.to_excel(os.path.join(directory, LENDERS_FILE), index=False)
+    shutil.copy(os.path.join(ROOT, COUNTRIES_FILE), os.path.join(directory, COUNTRIES_FILE))
+    return write_workbook(os.path.join(directory, DEALS_FILE), lender_rows, seed, lenders['Name'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic deal export and lender classification.')
+    parser.add_argument('outdir')
+    parser.add_argument('--rows', type=int, default=20_000, help='exploded lender rows')
+    parser.add_argument('--lenders', type=int, help='classified lenders (default: the real file)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    deals = write_dataset(args.outdir, args.rows, args.lenders, args.seed)
+    print('{:,} deals written to {}'.format(len(deals), args.outdir))
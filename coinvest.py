@@ -0,0 +1,71 @@
+"""Bank x institutional investor co-lending index.
+
+Built once per dataset from a sparse deal x lender incidence matrix over the
+mixed deals: for each sector, ``banks.T @ instos`` restricted to that
+sector's deals counts the deals every bank/investor pair lent to together.
+Looking up a sector at any threshold is then a scan of that sparse matrix's
+non-zero entries rather than a self-join of the lender rows.
+
+With the lake backend the rows stay out of core: ``lake.colending_pairs()``
+counts the pairs in DuckDB and ``pairs_coinvestment()`` builds the same index
+from that small table.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+EXCLUDED_CATEGORIES = ['Government Entity']
+
+
+def build_coinvestment(lenderdf, excluded=EXCLUDED_CATEGORIES):
+    """Return ``{'banks', 'instos', 'sectors'}`` with one sparse count matrix per sector."""
+    df = lenderdf[(lenderdf['Deal Category'] == 'Mixed') & ~lenderdf['Categories'].isin(excluded)
+                  & lenderdf['valueEUR'].notna()]
+    deal, deals = pd.factorize(df['Deal name'])
+    sector = pd.Series(df['dominantSector'].to_numpy(), index=deal).groupby(level=0).first()
+
+    matrices = {}
+    incidence = {}
+    for kind in ['Bank', 'Insto']:
+        rows = (df['Bank / Insto'] == kind).to_numpy()
+        lender, names = pd.factorize(df.loc[rows, 'name'])
+        m = sparse.csr_matrix((np.ones(len(lender), dtype=np.int32), (deal[rows], lender)),
+                              shape=(len(deals), len(names)))
+        m.sum_duplicates()
+        # Several tickets by one lender in a deal count as one deal
+        m.data[:] = 1
+        incidence[kind] = (m, names)
+
+    banks, banknames = incidence['Bank']
+    instos, instonames = incidence['Insto']
+    for name, dealids in sector.groupby(sector).groups.items():
+        dealids = np.asarray(dealids)
+        matrices[name] = (banks[dealids].T @ instos[dealids]).tocsr()
+
+    return {'banks': pd.Index(banknames), 'instos': pd.Index(instonames), 'sectors': matrices}
+
+
+def pairs_coinvestment(pairs):
+    """``build_coinvestment()``'s index from ``Sector, Bank, Insto, Deals`` rows of pair counts."""
+    bank, banknames = pd.factorize(pairs['Bank'])
+    insto, instonames = pd.factorize(pairs['Insto'])
+    deals = pairs['Deals'].to_numpy(dtype=np.int64)
+    matrices = {}
+    for name, rows in pd.Series(pairs['Sector'].to_numpy()).groupby(pairs['Sector'].to_numpy()).groups.items():
+        rows = np.asarray(rows)
+        matrices[name] = sparse.csr_matrix((deals[rows], (bank[rows], insto[rows])),
+                                           shape=(len(banknames), len(instonames)))
+    return {'banks': pd.Index(banknames), 'instos': pd.Index(instonames), 'sectors': matrices}
+
+
+def colending(index, sector, mindeals=2):
+    """Bank x investor table of deals done together, pairs below ``mindeals`` blank."""
+    m = index['sectors'].get(sector)
+    if m is None:
+        return pd.DataFrame()
+    m = m.tocoo()
+    keep = m.data >= mindeals
+    pairs = pd.DataFrame({'Bank': index['banks'][m.row[keep]], 'Insto': index['instos'][m.col[keep]],
+                          'Deals': m.data[keep]})
+    return pairs.pivot(index='Bank', columns='Insto', values='Deals')
@@ -0,0 +1,136 @@
+"""Pre-aggregated cube over the lender table.
+
+Streamlit reruns the whole script on every widget interaction, so the tab
+pivots are answered from a cube built once in ``get_data()`` rather than by
+re-scanning ``lenderdf``. Each cell of the cube holds the sum, count and sum
+of squares of ``valueEUR`` for one combination of dimension values, which is
+enough to rebuild sums, counts, means and standard deviations at any coarser
+grain.
+"""
+
+import numpy as np
+import pandas as pd
+
+VALUE = 'valueEUR'
+
+# Deal-level cube for the market charts, lender-level cube for the tables
+# that break volumes down by lender name.
+MARKET_DIMS = ['Deal Category', 'Bank / Insto', 'Categories', 'dominantSector', 'dominantCountry', 'Region',
+               'details.transactionType', 'positive']
+LENDER_DIMS = ['name', 'Deal Category', 'Bank / Insto', 'Categories', 'dominantSector', 'positive']
+SUNBURST_DIMS = ['Deal Category', 'dominantSector', 'dominantCountry', 'Bank / Insto', 'name']
+# Quarterly cube for the time view; a date range is a slice of its quarters
+PERIOD_DIMS = ['Quarter', 'Bank / Insto', 'dominantSector', 'positive']
+
+MEASURES = ['sum', 'count', 'sumsq']
+
+
+def build_cube(df, dims, value=VALUE):
+    """Aggregate ``df`` to one row per observed combination of ``dims``.
+
+    ``positive`` is a derived dimension flagging ``value > 0``, so charts that
+    only look at funded tickets can slice it rather than re-filter raw rows.
+    Missing dimension values are kept as their own cells so totals over other
+    dimensions still include those rows.
+    """
+    amount = df[value].astype('float64')
+    df = df.assign(positive=amount > 0, **{value: amount, '_sq': amount ** 2})
+    cube = df.groupby(dims, observed=True, dropna=False).agg(sum=(value, 'sum'), count=(value, 'count'), sumsq=('_sq', 'sum'))
+    return cube.reset_index()
+
+
+def update_cube(cube, removed, added, dims, value=VALUE):
+    """Cube after replacing the ``removed`` raw rows with the ``added`` ones.
+
+    Every measure is additive, so only the affected rows are re-aggregated:
+    their old contribution is subtracted and the new one added. Cells left
+    without any value are dropped.
+    """
+    old = build_cube(removed, dims, value)
+    old[MEASURES] = -old[MEASURES]
+    parts = pd.concat([cube, old, build_cube(added, dims, value)], ignore_index=True)
+    for col in dims:
+        if isinstance(cube[col].dtype, pd.CategoricalDtype):
+            parts[col] = parts[col].astype('category')
+    merged = parts.groupby(dims, observed=True, dropna=False)[MEASURES].sum().reset_index()
+    return merged[merged['count'] > 0].reset_index(drop=True)
+
+
+def rolling_cube(cube, periods=4, period='Quarter'):
+    """Cube of trailing windows of ``periods`` quarters, keyed by the window's last quarter.
+
+    Each cell is added to every window it falls in, and the measures summed
+    again. Windows end at every quarter from the first to the last observed
+    one, quiet quarters included; cells without a quarter are left out, as
+    are windows reaching back before the first quarter.
+    """
+    cube = cube[cube[period].notna()]
+    ends = pd.DatetimeIndex([])
+    if len(cube):
+        ends = pd.period_range(cube[period].min(), cube[period].max(), freq='Q').to_timestamp()
+        ends = ends[periods - 1:]
+    parts = []
+    for lag in range(periods):
+        shifted = cube.assign(**{period: cube[period] + pd.DateOffset(months=3 * lag)})
+        parts.append(shifted[shifted[period].isin(ends)])
+    dims = [col for col in cube.columns if col not in MEASURES]
+    return pd.concat(parts).groupby(dims, observed=True)[MEASURES].sum().reset_index()
+
+
+def select(cube, where):
+    """Rows of ``cube`` (or any frame of its dimensions) matching ``where``."""
+    if not where:
+        return cube
+    mask = np.ones(len(cube), dtype=bool)
+    for col, wanted in where.items():
+        if isinstance(wanted, (list, tuple, set)):
+            mask &= cube[col].isin(wanted).to_numpy()
+        else:
+            mask &= (cube[col] == wanted).to_numpy()
+    return cube[mask]
+
+
+def cube_pivot(cube, index, columns=None, aggfunc='sum', where=None, value=VALUE):
+    """Answer a ``pd.pivot_table(values=value, ...)`` call from the cube.
+
+    ``where`` maps dimension names to a value or a list of accepted values.
+    ``aggfunc`` is one of 'sum', 'count', 'mean' or 'std'. The result has the
+    same shape as the equivalent pivot_table over the raw rows: a single
+    ``value`` column without ``columns``, one column per value of ``columns``
+    otherwise.
+    """
+    keys = [index] if isinstance(index, str) else list(index)
+    if columns is not None:
+        keys.append(columns)
+
+    cells = select(cube, where).groupby(keys, observed=True)[MEASURES].sum()
+    cells = cells[cells['count'] > 0]
+
+    if aggfunc == 'sum':
+        result = cells['sum']
+    elif aggfunc == 'count':
+        result = cells['count']
+    elif aggfunc == 'mean':
+        result = cells['sum'] / cells['count']
+    elif aggfunc == 'std':
+        n = cells['count']
+        var = (cells['sumsq'] - cells['sum'] ** 2 / n) / (n - 1)
+        result = np.sqrt(var.clip(lower=0)).where(n > 1)
+    else:
+        raise ValueError('Unsupported aggfunc: {}'.format(aggfunc))
+
+    if columns is None:
+        result = result.to_frame(value)
+    else:
+        result = result.unstack(columns)
+        result.columns = _plain(result.columns)
+    result.index = _plain(result.index)
+    return result
+
+
+def _plain(index):
+    # Categorical dimensions come back as CategoricalIndex, which refuses new
+    # labels such as the 'Total' column the charts add.
+    if isinstance(index, pd.CategoricalIndex):
+        return index.astype(object)
+    return index
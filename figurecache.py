@@ -0,0 +1,157 @@
+"""On-disk cache of the dashboard's dataset-only views.
+
+Views such as the market stats, deal comparison and market participant
+figures depend on the dataset alone, yet a new server process (or a restart)
+would rebuild them with pandas and Plotly. ``cached_view()`` keeps each
+figure of a view as Plotly JSON in its own file, keyed by figure id and
+dataset key, next to a pickle of the view's tables with placeholders where
+the figures go. A later call, from any process, reads them back without
+validating the figures again, and Streamlit sends them to the browser as
+they are.
+
+The cache is bounded: once the files exceed ``MAX_MB``, the least recently
+used ones are deleted (every hit refreshes a file's modification time).
+Entries are also keyed by the source of the modules that draw the figures,
+so a deployment with changed charts does not serve old ones.
+
+    python figurecache.py    # prerender the default views after a store build
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+import plotly.graph_objects as go
+from plotly.basedatatypes import BaseFigure
+
+import analytics
+from hierarchy import TOP
+from ingest import CACHE_DIR, evict
+from store import STORE_DIR, ensure_store
+
+FIGURE_DIR = os.path.join(CACHE_DIR, 'figures')
+MAX_MB = 512
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Modules whose code shapes the cached figures
+FIGURE_CODE = ['analytics.py', 'hierarchy.py', 'cube.py', 'coinvest.py', 'lenderindex.py']
+
+
+def _code_key():
+    h = hashlib.sha256()
+    for name in FIGURE_CODE:
+        with open(os.path.join(HERE, name), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:12]
+
+
+CODE_KEY = _code_key()
+
+# Stands in for a figure in the pickled view: {PLACEHOLDER: figure id}
+PLACEHOLDER = '__cached_figure__'
+
+
+def _path(cache_dir, entry, dataset, suffix):
+    # Ids hold lender names, which need not be valid file names
+    name = hashlib.sha256(entry.encode()).hexdigest()[:24]
+    return os.path.join(cache_dir, '{}@{}-{}{}'.format(name, dataset, CODE_KEY, suffix))
+
+
+def _replace(path, data):
+    # A file of its own: other processes may be writing the same entry
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def load_figure(path):
+    """Figure from its cached JSON, without running Plotly's validators."""
+    with open(path) as f:
+        figure = go.Figure(json.load(f), _validate=False)
+    _touch(path)
+    return figure
+
+
+def _split(item, figure_id, figures):
+    # The view with every figure swapped for a placeholder, figures collected by id
+    if isinstance(item, BaseFigure):
+        figures[figure_id] = item
+        return {PLACEHOLDER: figure_id}
+    if isinstance(item, dict):
+        return {key: _split(value, '{}/{}'.format(figure_id, key), figures) for key, value in item.items()}
+    if isinstance(item, list):
+        return [_split(value, '{}/{}'.format(figure_id, i), figures) for i, value in enumerate(item)]
+    return item
+
+
+def _join(item, load):
+    if isinstance(item, dict) and list(item) == [PLACEHOLDER]:
+        return load(item[PLACEHOLDER])
+    if isinstance(item, dict):
+        return {key: _join(value, load) for key, value in item.items()}
+    if isinstance(item, list):
+        return [_join(value, load) for value in item]
+    return item
+
+
+def cached_view(view_id, dataset, build, cache_dir=FIGURE_DIR, max_mb=MAX_MB):
+    """``build()``'s view for this ``dataset`` key, from disk if it was built before.
+
+    ``view_id`` names the view and any option it was built with; figure ids
+    are the view id plus the figure's key path, e.g.
+    ``market_participants/top=20/treemaps/0``.
+    """
+    skeleton = _path(cache_dir, view_id, dataset, '.pkl')
+    try:
+        with open(skeleton, 'rb') as f:
+            view = pickle.load(f)
+        _touch(skeleton)
+        return _join(view, lambda figure_id: load_figure(_path(cache_dir, figure_id, dataset, '.json')))
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+        # Not cached yet, or a figure was evicted: rebuild the whole view
+        pass
+
+    view = build()
+    figures = {}
+    parts = _split(view, view_id, figures)
+    os.makedirs(cache_dir, exist_ok=True)
+    for figure_id, figure in figures.items():
+        _replace(_path(cache_dir, figure_id, dataset, '.json'), figure.to_json().encode())
+    # Skeleton last: it is only found once every figure it names is in place
+    _replace(skeleton, pickle.dumps(parts))
+    evict(cache_dir, max_mb)
+    return view
+
+
+def prerender(store_dir):
+    """Build the dataset-only views of the store into the cache."""
+    ensure_store(store_dir)
+    data = analytics.load_dataset(store_dir)
+    dataset = data['info']['key']
+    views = {
+        'market_stats': lambda: analytics.market_stats(data),
+        'deal_comparison': lambda: analytics.deal_comparison(data, benchmark=None),
+        'benchmark/{}'.format(analytics.BENCHMARK): lambda: analytics.benchmark_comparison(data, analytics.BENCHMARK),
+        'market_participants/top={}'.format(TOP): lambda: analytics.market_participants(data, TOP),
+    }
+    for view_id, build in views.items():
+        cached_view(view_id, dataset, build)
+        print(view_id)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prerender the dataset-only dashboard views into the figure cache.')
+    parser.add_argument('--store', default=STORE_DIR, help='store directory')
+    args = parser.parse_args()
+    prerender(args.store)
@@ -0,0 +1,109 @@
+"""Pre-aggregated hierarchies for the treemap and sunburst charts.
+
+Handing raw lender rows to ``px.treemap`` ships one node per row to the
+browser. ``aggregate_path()`` sums the value at the leaf level of the path
+first and, walking down the path, keeps the ``top`` children by volume under
+each parent, folding the rest into a single 'Other (n)' node whose subtree is
+cut there. ``hierarchy_figure()`` then sums every level of that table into
+explicit ids/parents/values, so the figure has at most ``top`` children per
+node whatever the number of deals. Input already folded at its last level,
+as ``lake.top_sums()`` returns it, passes through unchanged: 'Other (n)'
+nodes do not compete for the top places.
+"""
+
+import re
+
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+TOP = 20
+
+# Above this many distinct values a discrete colour column is dropped and the
+# chart falls back to colouring by its first level.
+MAX_COLORS = 30
+
+OTHER = 'Other ({})'
+_FOLDED = re.compile(r'Other \(\d+\)')
+
+
+def _sum(df, path, value):
+    return df.groupby(path, dropna=False, sort=False)[value].sum().reset_index()
+
+
+def aggregate_path(df, path, value='valueEUR', top=TOP):
+    """Rows of ``path`` + ``value`` with each parent keeping ``top`` children."""
+    df = _sum(df[path + [value]].astype({col: object for col in path}), path, value)
+    for depth, level in enumerate(path):
+        parents = path[:depth]
+        prefolded = df[level].astype(str).str.fullmatch(_FOLDED).to_numpy(dtype=bool)
+        # Sorted, so ties at the cut go the same way whatever order the rows came in
+        nodes = df[~prefolded].groupby(parents + [level], dropna=False)[value].sum()
+        ranks = nodes.groupby(level=parents, dropna=False, sort=False) if parents else nodes
+        ranks = ranks.rank(ascending=False, method='first')
+        if not (ranks > top).any():
+            continue
+
+        kept = ranks.index[ranks <= top]
+        if parents:
+            fold = ~pd.MultiIndex.from_frame(df[parents + [level]]).isin(kept) & ~prefolded
+            folded = df[fold].groupby(parents, dropna=False, sort=False)[level].transform('nunique')
+        else:
+            fold = ~df[level].isin(kept) & ~prefolded
+            folded = pd.Series(df.loc[fold, level].nunique(), index=df.index[fold])
+        df.loc[fold, level] = folded.astype(int).map(OTHER.format)
+        df.loc[fold, path[depth + 1:]] = None
+        df = _sum(df, path, value)
+    return df
+
+
+def _ids(level, cols):
+    ids = level[cols[0]].astype(str)
+    for col in cols[1:]:
+        ids = ids + '/' + level[col].astype(str)
+    return ids
+
+
+def hierarchy_nodes(data, path, value='valueEUR', color=None):
+    """One row per node of the hierarchy: id, parent, label, value, colour key.
+
+    Rows cut short by folding have missing deeper levels and stop there.
+    """
+    nodes = []
+    for depth, level in enumerate(path):
+        cols = path[:depth + 1]
+        sums = data[data[level].notna()].groupby(cols, sort=False)[value].sum().reset_index()
+        nodes.append(pd.DataFrame({
+            'id': _ids(sums, cols),
+            'parent': _ids(sums, cols[:-1]) if depth else '',
+            'label': sums[level].astype(str),
+            'value': sums[value],
+            'colour': sums[color] if color in cols else None,
+        }))
+    return pd.concat(nodes, ignore_index=True)
+
+
+def hierarchy_figure(kind, df, path, value='valueEUR', color=None, top=TOP, max_colors=MAX_COLORS):
+    """Treemap or sunburst of ``df`` over its aggregated path.
+
+    ``color`` names a path level whose values get one discrete colour each,
+    shared by the nodes beneath it; it is ignored above ``max_colors``
+    distinct values.
+    """
+    data = aggregate_path(df, path, value, top)
+    if color is not None and (color not in path or data[color].nunique() > max_colors):
+        color = None
+    nodes = hierarchy_nodes(data, path, value, color)
+
+    trace = {'treemap': go.Treemap, 'sunburst': go.Sunburst}[kind]
+    marker = {}
+    if color is not None:
+        palette = px.colors.qualitative.Plotly
+        keys = nodes['colour'].dropna().unique()
+        colours = dict(zip(keys, (palette[i % len(palette)] for i in range(len(keys)))))
+        marker = {'colors': nodes['colour'].map(colours).fillna('lightgrey').tolist()}
+
+    fig = go.Figure(trace(ids=nodes['id'], parents=nodes['parent'], labels=nodes['label'], values=nodes['value'],
+                          branchvalues='total', marker=marker))
+    fig.update_layout(margin={'t': 50, 'l': 25, 'r': 25, 'b': 25})
+    return fig
@@ -1,15 +1,29 @@
 import pandas as pd
-import plotly.express as px
 import plotly.io as pio
 import streamlit as st
-from ast import literal_eval
-
-from sklearn.cluster import KMeans
+import time
+
+import profiling
+from analytics import (BENCHMARK, SEGMENT_DIMENSIONS, SEGMENT_INVESTORS, benchmark_comparison, cluster_figure,
+                       data_quality, deal_comparison, elbow_figure, investor_deals, load_dataset, market_participants,
+                       market_stats, quarters, segment_features, time_periods)
+from coinvest import colending
+from figurecache import cached_view
+from hierarchy import TOP
+from lenderindex import canonical_name, present_names
+from segmentation import (DIMENSIONS, ELBOW_METHODS, SILHOUETTE_SAMPLE, TICKET_EDGES, cluster_investors, elbow_curve,
+                          reduce_features)
+from store import ensure_store
 
 pio.renderers.default = 'iframe'
 
 st.set_page_config(layout = 'wide')
 
+# Opt-in stage timings and cache hit rates, shown in the sidebar: ?profile=1 or INFRAMATION_PROFILE=1
+profile = profiling.env_enabled() or st.query_params.get('profile') == '1'
+if profile:
+    profiling.start()
+
 
 st.title('Project finance Europe - market analysis')
 
@@ -21,95 +35,92 @@ with col2:
 with col3:
     st.image('https://plus.unsplash.com/premium_photo-1682320426935-f0614a9a6517?ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxzZWFyY2h8MTN8fGJyaWRnZXxlbnwwfHwwfHx8MA%3D%3D&auto=format&fit=crop&w=500&q=60')
 
-@st.cache_data
-def get_data():
+# A resource, not data: every session shares the one dataset, whose frames are
+# read-only views of the memory-mapped store, instead of unpickling a copy
+@profiling.tracked(st.cache_resource(max_entries=1))
+def get_data(dataset):
     # path = 'C:/Users/matth/OneDrive/Asus old pc/Documents/Inframation_Europe_Deals since 2021/'
 
-    bigdf = pd.read_excel('deals_insto_europe.xlsx')
-    bigdf['lendersFundingValues'] = bigdf['lendersFundingValues'].apply(literal_eval)
+    # dataset is only part of the cache key: a rebuilt store or an applied delta reloads the data
+    return load_dataset()
 
-    uniqueLenders = pd.read_excel('uniquelenders_classified_for_upload.xlsx')
+with profiling.stage('ensure_store'):
+    dataset = ensure_store()
+data = get_data(dataset)
+instolist,coinvestment,datainfo = data['instolist'],data['coinvestment'],data['info']
 
-    lenderdf = pd.DataFrame(bigdf.pop('lendersFundingValues').explode())
-    lenderdf = pd.concat([lenderdf, lenderdf['lendersFundingValues'].apply(pd.Series)], axis=1)
-    lenderdf = bigdf.join(lenderdf)
+with st.sidebar.expander('Dataset'):
+    st.caption('Version {} - {} delta(s) applied since the last full export'.format(datainfo['version'], len(datainfo['deltas'])))
+    st.write(pd.Series(datainfo['memory']).map('{:,.1f}'.format))
 
-    countriesregions = pd.read_excel('uniquecountries.xlsx')
+with st.sidebar.expander('Data quality'):
+    quality = data_quality(data)
+    st.caption('What the processing dropped from the latest full export, and countries without a region')
+    st.dataframe(quality['summary'])
+    if len(quality['unmatchedlenders']):
+        st.write('Lenders missing from the classification')
+        st.dataframe(quality['unmatchedlenders'],hide_index=True)
+    if len(quality['unknowncountries']):
+        st.write('Countries missing from the country table')
+        st.dataframe(quality['unknowncountries'],hide_index=True)
+    if len(quality['zerovaluedeals']):
+        st.write('Deals without a positive debt size (first {:,})'.format(len(quality['zerovaluedeals'])))
+        st.dataframe(quality['zerovaluedeals'],hide_index=True)
 
-    lenderdf = lenderdf.merge(uniqueLenders,left_on='name',right_on='Name')
 
-    instolist = lenderdf[lenderdf['Bank / Insto']=='Insto']['name'].unique().tolist()
-
-    def WhichCat(bank, insto):
-        if bank > 0 and insto > 0:
-            return 'Mixed'
-        elif insto > 0:
-            return 'Insto only'
-        else:
-            return 'Bank only'
+# Only the selected view runs. Figures that depend on the dataset alone are built
+# once per dataset and shared across reruns and sessions, and across processes
+# and restarts through the figure cache on disk.
 
-    dealcat = pd.pivot_table(lenderdf[lenderdf['valueEUR'] > 0], values='valueEUR', index='Deal name',
-                             columns='Bank / Insto', aggfunc='sum')
+@profiling.tracked(st.cache_resource(max_entries=2))
+def market_stats_view(dataset):
+    return cached_view('market_stats', dataset, lambda: market_stats(data))
 
-    dealcat['Deal Category'] = dealcat.apply(lambda x: WhichCat(x['Bank'], x['Insto']), axis=1)
-    dealcat.reset_index(inplace=True)
 
-    lenderdf = lenderdf.merge(dealcat, how='left', on='Deal name')
-    lenderdf = lenderdf[lenderdf['summary.debtsizeEUR']>0]
+@profiling.tracked(st.cache_resource(max_entries=2))
+def deal_comparison_view(dataset):
+    return cached_view('deal_comparison', dataset, lambda: deal_comparison(data, benchmark=None))
 
-    allocationdf = pd.pivot_table(lenderdf, values='valueEUR', index=['dominantSector', 'Bank / Insto'], aggfunc='sum')
-    allocationdf.reset_index(inplace=True)
-    allocationdf['Percent'] = 100 * allocationdf['valueEUR'] / allocationdf.groupby('Bank / Insto')['valueEUR'].transform('sum')
 
-    instodeals = lenderdf[lenderdf['Bank / Insto'] == 'Insto']
+@profiling.tracked(st.cache_resource(max_entries=8))
+def benchmark_view(dataset, benchmark):
+    return cached_view('benchmark/{}'.format(benchmark), dataset, lambda: benchmark_comparison(data, benchmark))
 
-    marketsunburstvol = pd.pivot_table(lenderdf, values='valueEUR',
-                                    index=['Deal Category', 'dominantSector', 'dominantCountry', 'Bank / Insto',
-                                           'name'], aggfunc='sum')
-    marketsunburstvol.reset_index(inplace=True)
 
+@profiling.tracked(st.cache_resource(max_entries=2))
+def market_participants_view(dataset, top):
+    return cached_view('market_participants/top={}'.format(top), dataset, lambda: market_participants(data, top))
 
-    return bigdf,uniqueLenders,lenderdf,countriesregions,allocationdf,instodeals,instolist, marketsunburstvol
 
-bigdf,uniquelenders,lenderdf,countriesregions,allocationdf,instodeals,instolist, marketsunburstvol = get_data()
+# Slider positions are few, so each range is kept rather than re-sliced on return
+@profiling.tracked(st.cache_resource(max_entries=32))
+def time_periods_view(dataset, start, end):
+    return time_periods(data, start, end)
 
 
-tab1,tab2,tab3,tab4 = st.tabs(['General market stats','Deal comparison: bank vs insto','Market participants','Segmentation'])
+VIEWS = ['General market stats','Deal comparison: bank vs insto','Market participants','Segmentation','Time periods']
 
-with tab1:
+view = st.radio('View',VIEWS,horizontal=True,label_visibility='collapsed')
+viewstart = time.perf_counter()
+viewstage = profiling.begin(view)
 
-    df = pd.pivot_table(lenderdf,values='valueEUR',index=['Bank / Insto'],aggfunc='sum')
-    df['Pct']=df['valueEUR']*100/df['valueEUR'].sum()
-    df.reset_index(inplace=True)
+if view == 'General market stats':
 
-    instodealnb = instodeals['Deal name'].unique().tolist()
-
-    nbinstodeals = len(instodealnb)
-    nbdeals = len(lenderdf['Deal name'].unique().tolist())
+    figs = market_stats_view(datainfo['key'])
+    headline = figs['headline']['Value']
 
     st.header('General statistics on the market')
 
     col1,col2,col3,col4 = st.columns(4)
     with col1:
-        st.metric('Total market size bn EUR','{:,.2f}'.format(df['valueEUR'].sum()/1000))
+        st.metric('Total market size bn EUR','{:,.2f}'.format(headline['Total market size bn EUR']))
     with col2:
-        st.metric('Institutional share of market','{:,.2f}'.format(float(df[df['Bank / Insto']=='Insto']['Pct'])))
+        st.metric('Institutional share of market','{:,.2f}'.format(headline['Institutional share of market']))
     with col3:
-        st.metric('Total Insto market size bn EUR','{:,.2f}'.format(df[df['Bank / Insto']=='Insto']['valueEUR'].sum()/1000))
+        st.metric('Total Insto market size bn EUR','{:,.2f}'.format(headline['Total Insto market size bn EUR']))
     with col4:
-        st.metric('Number of deals with instos / total deals','{:,}'.format(nbinstodeals)+' / '+'{:,}'.format(nbdeals))
-
-
+        st.metric('Number of deals with instos / total deals','{:,}'.format(int(headline['Deals with instos']))+' / '+'{:,}'.format(int(headline['Total deals'])))
 
-    bankonly = len(lenderdf[lenderdf['Deal Category']=='Bank only']['Deal name'].unique().tolist())
-    instoonly = len(lenderdf[lenderdf['Deal Category']=='Insto only']['Deal name'].unique().tolist())
-    mixed = len(lenderdf[lenderdf['Deal Category']=='Mixed']['Deal name'].unique().tolist())
-
-    df = pd.pivot_table(lenderdf,values='valueEUR',index='Deal Category',aggfunc='sum')
-    df['Deal number']=[bankonly,instoonly,mixed]
-    df['Average deal size mEUR']= df['valueEUR']/df['Deal number']
-
-    df.reset_index(inplace=True)
 
     col1,col2 = st.columns(2)
 
@@ -117,18 +128,16 @@ with tab1:
         st.header('Market split - Banks, Instos, Mixed deals (volume)')
 
         st.info('Half of the market by volume involves instos')
-        fig = px.sunburst(marketsunburstvol,path=['Deal Category','dominantSector','dominantCountry'],values='valueEUR')
-        st.write(fig)
+        st.write(figs['sunburst'])
 
     with col2:
         st.header('Market split - Banks, Instos, Mixed deals (deal count)')
 
         st.info('Smaller deals are bank only, while large deals involve a higher proportion of instos')
-        fig = px.bar(df,x=['Deal number','Average deal size mEUR'],y='Deal Category',barmode='group',labels={'x':'Average deal size mEUR / Deal count','y':'Deal Category'})
-        st.write(fig)
+        st.write(figs['dealcount'])
 
         with st.expander('See data'):
-            df
+            figs['categories']
 
 
     col1,col2,col3 = st.columns(3)
@@ -136,250 +145,116 @@ with tab1:
     with col1:
         st.subheader('Banks vs Insto by volume')
         st.info('The size of the bank market is 5x larger than that of the insto market, in PF loans.')
-        # fig = px.line_polar(allocationdf,r='valueEUR',theta='dominantSector',color='Insto investor')
-        # st.write(fig)
-
-        fig = px.bar(allocationdf,x='valueEUR',y='dominantSector',color='Bank / Insto')
-        fig.update_layout(yaxis={'categoryorder':'total ascending'})
-        st.write(fig)
+        st.write(figs['volume'])
 
     with col2:
         st.subheader('Banks vs Insto by percentage allocation')
         st.info('Institutional investors allocate more to renewables and transport, less to telecommunications than banks.')
-
-        fig = px.line_polar(allocationdf,r='Percent',theta='dominantSector',color='Bank / Insto')
-        st.write(fig)
+        st.write(figs['allocation'])
 
     with col3:
         st.subheader('Average ticket size bank vs insto')
         st.info('Institutional investors tend to invest in larger tickets vs banks')
-        alldeals = pd.pivot_table(lenderdf[lenderdf['valueEUR']>0],index='dominantSector',values='valueEUR',columns='Bank / Insto',aggfunc='mean')
-
-        fig = px.bar(alldeals,x=['Bank','Insto'],barmode='group')
-        fig.update_layout(yaxis={'categoryorder':'total ascending'})
-        st.write(fig)
+        st.write(figs['tickets'])
 
-with tab2:
+elif view == 'Deal comparison: bank vs insto':
     st.header('What do deals with instos look like vs deals without instos?')
 
+    benchmarks = present_names(data['lenderindex'])
+    default = canonical_name(data['lenderindex'], BENCHMARK)
+    benchmark = st.selectbox('Benchmark lender',benchmarks,index=benchmarks.index(default) if default in benchmarks else 0)
 
-
+    figs = {**deal_comparison_view(datainfo['key']), **benchmark_view(datainfo['key'], benchmark)}
 
     col1,col2 = st.columns(2)
 
     with col1:
-
         st.subheader('Total invested on bank only deals')
-
-        df = pd.pivot_table(lenderdf[lenderdf['Deal Category'] == 'Bank only'], index='dominantSector', values='valueEUR',aggfunc='sum')
-        fig = px.bar(df)
-        fig.update_layout(xaxis={'categoryorder':'total descending'})
-        st.write(fig)
+        st.write(figs['bankvolume'])
 
     with col2:
-
         st.subheader('Average ticket size on bank only deals')
-
-        df = pd.pivot_table(lenderdf[lenderdf['Deal Category'] == 'Bank only'], index='dominantSector', values='valueEUR',
-                            aggfunc='mean')
-
-        norddflong = lenderdf[(lenderdf['Deal Category'] == 'Bank only') & (lenderdf['name'].str.contains('Norddeutsche'))]
-        norddf = pd.pivot_table(norddflong, index='dominantSector', values='valueEUR', aggfunc='mean')
-
-        df = df.merge(norddf,left_index=True,right_index=True)
-        df.columns=['Market average ticket','Nord/LB average ticket']
-
-        fig = px.bar(df,barmode='group')
-        fig.update_layout(xaxis={'categoryorder':'total descending'})
-        st.write(fig)
+        st.write(figs['banktickets'])
 
         with st.expander('See data'):
-            norddflong
+            figs['bankbenchmark']
 
 
     col1,col2 = st.columns(2)
 
     with col1:
-
         st.subheader('Total invested on insto only deals')
-
-        df = pd.pivot_table(lenderdf[lenderdf['Deal Category'] == 'Insto only'], index='dominantSector', columns='Categories',values='valueEUR',aggfunc='sum')
-        fig = px.bar(df)
-        fig.update_layout(xaxis={'categoryorder':'total descending'})
-        st.write(fig)
+        st.write(figs['instovolume'])
 
     with col2:
-
         st.subheader('Average ticket size on insto only deals')
-
-        df = pd.pivot_table(lenderdf[lenderdf['Deal Category'] == 'Insto only'], index='dominantSector', values='valueEUR',
-                            aggfunc='mean')
-
-        fig = px.bar(df)
-        fig.update_layout(xaxis={'categoryorder':'total descending'})
-        st.write(fig)
+        st.write(figs['instotickets'])
 
 
     col1,col2 = st.columns(2)
 
     with col1:
-
         st.subheader('Total invested on mixed deals')
-
-        df = pd.pivot_table(lenderdf[lenderdf['Deal Category'] == 'Mixed'], index='dominantSector', columns='Categories',values='valueEUR',aggfunc='sum')
-        fig = px.bar(df)
-        fig.update_layout(xaxis={'categoryorder':'total descending'})
-        st.write(fig)
+        st.write(figs['mixedvolume'])
 
         st.subheader('Percentage of volume by deal type and sector')
-
-        dfbysector = pd.pivot_table(lenderdf[(lenderdf['Deal Category'] == 'Mixed')], index=['dominantSector'],
-                                    values='valueEUR', columns=['details.transactionType'], aggfunc='sum')
-        dfbysector = dfbysector[['Greenfield', 'Additional Financing', 'Refinancing']]
-
-        dfbysector['Total'] = dfbysector.sum(axis=1)
-        for col in dfbysector.columns:
-            dfbysector[col] = dfbysector[col] / dfbysector['Total']
-        dfbysector = dfbysector.iloc[:, :-1]
-
-        fig = px.imshow(dfbysector.transpose(), text_auto='.2%', color_continuous_scale='greens', )
-        fig.update(layout_coloraxis_showscale=False)
-
-        st.write(fig)
+        st.write(figs['stagebysector'])
 
         st.subheader('Percentage of volume by deal type and lender category')
-
-        dfbytype = pd.pivot_table(lenderdf[(lenderdf['Deal Category'] == 'Mixed')], index='Categories',
-                                  values='valueEUR', columns=['details.transactionType'], aggfunc='sum')
-        dfbytype = dfbytype[['Greenfield', 'Additional Financing', 'Refinancing']]
-
-        dfbytype['Total'] = dfbytype.sum(axis=1)
-        for col in dfbytype.columns:
-            dfbytype[col] = dfbytype[col] / dfbytype['Total']
-        dfbytype = dfbytype.iloc[:, :-1]
-
-        fig = px.imshow(dfbytype.transpose(), text_auto='.2%', color_continuous_scale='greens')
-        fig.update(layout_coloraxis_showscale=False)
-        st.write(fig)
+        st.write(figs['stagebytype'])
 
     with col2:
-
         st.subheader('Average ticket size on mixed deals')
-
-        df = pd.pivot_table(lenderdf[lenderdf['Deal Category'] == 'Mixed'], index='dominantSector',values='valueEUR',
-                            aggfunc='mean')
-
-
-        norddflong = lenderdf[(lenderdf['Deal Category'] == 'Mixed') & (lenderdf['name'].str.contains('Norddeutsche'))]
-        norddf = pd.pivot_table(norddflong, index='dominantSector', values='valueEUR',aggfunc='mean')
-
-        df = df.merge(norddf,left_index=True,right_index=True)
-        df.columns=['Market average ticket','Nord/LB average ticket']
-
-        fig = px.bar(df,barmode='group')
-        fig.update_layout(xaxis={'categoryorder':'total descending'})
-        st.write(fig)
-
+        st.write(figs['mixedtickets'])
 
         st.subheader('Average ticket size on mixed deals - split by lender type')
-
-        df = pd.pivot_table(lenderdf[lenderdf['Deal Category'] == 'Mixed'], index=['dominantSector'],columns='Categories',values='valueEUR', aggfunc='mean')
-
-        fig = px.bar(df,barmode='group')
-        st.write(fig)
+        st.write(figs['mixedtypetickets'])
 
         with st.expander('See data'):
-            norddflong
-            df
-
-
-
-with tab3:
+            figs['mixedbenchmark']
+            figs['mixedtypedata']
 
 
-    fig = px.treemap(lenderdf[lenderdf['valueEUR'] > 0], path=['Deal Category','Bank / Insto', 'dominantSector', 'Categories','name', 'Deal name'],
-                     values='valueEUR', color='name')
-    st.write(fig)
+elif view == 'Market participants':
 
-    fig = px.treemap(lenderdf[lenderdf['valueEUR'] > 0], path=['Deal Category', 'Bank / Insto','Categories','name', 'dominantSector', 'Deal name'],
-                     values='valueEUR', color='name')
-    st.write(fig)
+    top = st.number_input('Largest items shown per parent in the treemaps',min_value=1,value=TOP,step=5)
+    figs = market_participants_view(datainfo['key'], top)
 
-    fig = px.treemap(lenderdf[lenderdf['valueEUR'] > 0],
-                     path=['dominantSector', 'Deal Category','Categories', 'name', 'Deal name'],
-                     values='valueEUR', color='name')
-    st.write(fig)
+    for fig in figs['treemaps']:
+        st.write(fig)
 
     st.header('Banks that have the highest proportion of mixed deals')
 
     st.caption('Min 10 deals in the sector')
 
-    mixeddf = pd.pivot_table(lenderdf[(lenderdf['Bank / Insto']=='Bank')&(lenderdf['Deal Category']=='Mixed')],index=['name'],columns='dominantSector',values='valueEUR',aggfunc='count')
-    df = pd.pivot_table(lenderdf[lenderdf['Bank / Insto'] == 'Bank'],
-                        index=['name'], columns='dominantSector', values='valueEUR', aggfunc='count')
-
-
-#min 10 deals per bank
-
-    df = df[(df>10)]
-
-    df = mixeddf.div(df)
-    df.dropna(how='all', inplace=True)
-    st.write(df.style.format('{:.2%}'))
+    st.write(figs['mixedshare'].style.format('{:.2%}'))
 
     st.header('Which banks with which investors?')
-    st.caption('Min 2 deals together')
     st.caption('Government entities are excluded')
 
-    st.subheader('Renewables')
-
-    mixdealbanks = lenderdf[(lenderdf['Deal Category']=='Mixed')&(lenderdf['Bank / Insto']=='Bank')&(lenderdf['Categories']!='Government Entity')&(lenderdf['dominantSector']=='Renewables')]
-    mixdealinstos = lenderdf[(lenderdf['Deal Category']=='Mixed')&(lenderdf['Bank / Insto']=='Insto')&(lenderdf['Categories']!='Government Entity')&(lenderdf['dominantSector']=='Renewables')]
-
-    mixdealbanks['Banks'] = mixdealbanks['name']
-    mixdealinstos['Instos'] = mixdealbanks['name']
+    sectorlist = sorted(coinvestment['sectors'])
+    colsectors = st.multiselect('Sectors',sectorlist,[sec for sec in ['Renewables','Telecommunications'] if sec in sectorlist])
+    mintogether = st.number_input('Min number of deals together',min_value=1,value=2,step=1)
 
-    bigdf = mixdealbanks.merge(mixdealinstos,left_on='Deal name',right_on='Deal name')
-
-    df = pd.pivot_table(bigdf,values='valueEUR_x',index ='Name_x' ,columns='Name_y',aggfunc='count')
-    df = df[df>1]
-    df.dropna(how='all',inplace=True)
-    df.dropna(how='all', axis=1,inplace=True)
-    df
-
-    st.subheader('Telecommunications')
-
-    mixdealbanks = lenderdf[(lenderdf['Deal Category']=='Mixed')&(lenderdf['Bank / Insto']=='Bank')&(lenderdf['Categories']!='Government Entity')&(lenderdf['dominantSector']=='Telecommunications')]
-    mixdealinstos = lenderdf[(lenderdf['Deal Category']=='Mixed')&(lenderdf['Bank / Insto']=='Insto')&(lenderdf['Categories']!='Government Entity')&(lenderdf['dominantSector']=='Telecommunications')]
-
-    mixdealbanks['Banks'] = mixdealbanks['name']
-    mixdealinstos['Instos'] = mixdealbanks['name']
-
-    bigdf = mixdealbanks.merge(mixdealinstos,left_on='Deal name',right_on='Deal name')
-
-    df = pd.pivot_table(bigdf,values='valueEUR_x',index ='Name_x' ,columns='Name_y',aggfunc='count')
-    df = df[df>1]
-    df.dropna(how='all',inplace=True)
-    df.dropna(how='all', axis=1,inplace=True)
-    df
+    for sector in colsectors:
+        st.subheader(sector)
+        df = colending(coinvestment,sector,mintogether)
+        df
 
     st.header('List deals by investor')
 
     instoselect = st.selectbox('Pick an investor',instolist)
 
-    lenderdf[(lenderdf['name'].str.contains(instoselect)) & (lenderdf['name'] != 'N/A')&(lenderdf['valueEUR'] > 0)]
+    investor_deals(data, instoselect)
 
     # Average ticket size by insto vs ticket size per deal?
 
-    instolenderdf = lenderdf[(lenderdf['Bank / Insto']=='Insto')&(lenderdf['valueEUR']>0)]
-
     includesector = st.selectbox('Select data',['Investors only','Include sector'])
 
     if includesector == 'Investors only':
-        df = pd.pivot_table(instolenderdf,values='valueEUR',index='name',aggfunc=['count','sum','mean','median'])
+        df = figs['investortickets']
     else:
-        df = pd.pivot_table(instolenderdf, values='valueEUR', index=['name', 'dominantSector'],
-                            aggfunc=['count', 'sum', 'mean', 'median'])
+        df = figs['investorsectortickets']
 
     # df.to_excel('ticketsizes.xlsx')
 
@@ -387,162 +262,81 @@ with tab3:
 
     st.header('Deals where instos invest')
 
-    df = pd.pivot_table(instolenderdf,values='summary.debtsizeEUR',index=['dominantSector'],aggfunc=['count','mean','median'])
-    df
+    figs['instodeals']
 
-with tab4:
+elif view == 'Segmentation':
 
     st.header('Segmentation dimensions')
     # st.header('Insto sector allocation')
 
-    categorieslist = lenderdf['Categories'].unique().tolist()
+    categorieslist = data['marketcube']['Categories'].unique().tolist()
 
     with st.form('segments'):
-        investorcat = st.multiselect('Select your investor types',categorieslist,['Asset Manager','Insurance','Pension Fund'])
-        dimensions = st.multiselect('Select your dimensions',['Sector','Ticket size','Deal stage','Country'],['Sector','Ticket size'])
+        investorcat = st.multiselect('Select your investor types',categorieslist,SEGMENT_INVESTORS)
+        dimensions = st.multiselect('Select your dimensions',DIMENSIONS,SEGMENT_DIMENSIONS)
         k = st.number_input('Please input desired number of clusters', 2, 12, 4, key=2)
+        elbowmethod = st.selectbox('Elbow curve method',ELBOW_METHODS,help='MiniBatchKMeans is faster on large investor universes')
+        ticketmode = st.radio('Ticket size buckets',['Fixed edges','Quantiles'],horizontal=True)
+        ticketedges = st.text_input('Bucket edges (mEUR)',', '.join(map(str,TICKET_EDGES)),help='Used with fixed edges, e.g. 25, 60, 100, 250')
+        ticketquantiles = st.number_input('Number of quantile buckets',2,10,4,help='Used with quantiles')
+        components = st.number_input('Principal components to cluster on',0,50,0,help='0 clusters on all features; a few components tame wide country matrices')
         st.form_submit_button('Submit')
 
+    try:
+        ticketedges = tuple(float(edge) for edge in ticketedges.split(',') if edge.strip())
+    except ValueError:
+        st.error('Bucket edges must be numbers separated by commas')
+        st.stop()
+    ticketquantiles = ticketquantiles if ticketmode == 'Quantiles' else None
+    components = components or None
 
-    #list investors min x deals
 
-    df = lenderdf[(lenderdf['Categories'].isin(investorcat)) & (lenderdf['Deal Category'] != 'Bank only')&(lenderdf['valueEUR'] >0)]
     mindeals = st.number_input('Min number of deals',value=2,step=1)
-    countdf = pd.pivot_table(df,index='Name',values='valueEUR',aggfunc='count')
-    countdf = countdf[countdf['valueEUR']>=mindeals]
-    countdf.reset_index(inplace=True)
-    investorlist = countdf['Name'].unique().tolist()
-
-    df = df[df['Name'].isin(investorlist)]
-    df = pd.pivot_table(df, index='Name',values='valueEUR',columns='dominantSector')
-    df.dropna()
-    df['Total'] = df.sum(axis=1)
-    for col in df.columns:
-        df[col] = df[col]/df['Total']
-
-    df = df[[col for col in df.columns[:-1]]]
-    df = df.fillna(0)
-    allocdf = df
-
-
-    # st.header('Insto ticket size distribution')
-
-    df = lenderdf[(lenderdf['Categories'].isin(investorcat)) & (lenderdf['Deal Category'] != 'Bank only')&(lenderdf['valueEUR'] >0)]
-    countdf = pd.pivot_table(df, index='Name', values='valueEUR', aggfunc='count')
-    countdf = countdf[countdf['valueEUR'] >= mindeals]
-    countdf.reset_index(inplace=True)
-    investorlist = countdf['Name'].unique().tolist()
-
-    df = df[df['Name'].isin(investorlist)]
-
-    def ticketbucket(ticket):
-        if ticket<=60:
-            return 'Less than 60'
-        elif ticket <=100:
-            return 'Less than 100'
-        else:
-            return 'More than 100'
-
-    df['Ticket bucket'] = df['valueEUR'].apply(ticketbucket)
-
-    df = pd.pivot_table(df,index='Name',values='valueEUR',columns='Ticket bucket',aggfunc='count')
-
-    df['Total'] = df.sum(axis=1)
-    for col in df.columns:
-        df[col] = df[col] / df['Total']
-
-    df = df[[col for col in df.columns[:-1]]]
-    df = df.fillna(0)
-    df = df[['Less than 60','Less than 100','More than 100']]
-    ticketdf = df
-
 
-    # st.header('Greenfield / Brownfield distribution')
+    # Memoized on the form inputs, so changing only k reuses the features and elbow curve
 
-    df = lenderdf[(lenderdf['Categories'].isin(investorcat)) & (lenderdf['Deal Category'] != 'Bank only')&(lenderdf['valueEUR'] >0)]
-    countdf = pd.pivot_table(df, index='Name', values='valueEUR', aggfunc='count')
-    countdf = countdf[countdf['valueEUR'] >= mindeals]
-    countdf.reset_index(inplace=True)
-    investorlist = countdf['Name'].unique().tolist()
+    @profiling.tracked(st.cache_data)
+    def segment_feature_matrix(dataset, investorcat, dimensions, mindeals, ticketedges, ticketquantiles):
+        return segment_features(data, investorcat, dimensions, mindeals, ticketedges, ticketquantiles)
 
-    df = df[df['Name'].isin(investorlist)]
+    @profiling.tracked(st.cache_data)
+    def segment_elbow(features, method, components):
+        start = time.perf_counter()
+        wcss = elbow_curve(reduce_features(features, components)[0], method=method)
+        return wcss, time.perf_counter() - start
 
-    df = pd.pivot_table(df, index='Name', values='valueEUR', columns='details.transactionType', aggfunc='sum')
+    df = segment_feature_matrix(datainfo['key'], investorcat, dimensions, mindeals, ticketedges, ticketquantiles)
 
-    df['Total'] = df.sum(axis=1)
-    for col in df.columns:
-        df[col] = df[col] / df['Total']
-
-    df = df[[col for col in df.columns[:-1]]]
-    df = df.fillna(0)
-
-    df = df[['Greenfield','Additional Financing','Refinancing']]
-    stagedf = df
-
-    # st.header('Country distribution')
-
-    df = lenderdf[(lenderdf['Categories'].isin(investorcat)) & (lenderdf['Deal Category'] != 'Bank only')&(lenderdf['valueEUR'] >0)]
-    countdf = pd.pivot_table(df,index='Name',values='valueEUR',aggfunc='count')
-    countdf = countdf[countdf['valueEUR']>=mindeals]
-    countdf.reset_index(inplace=True)
-    investorlist = countdf['Name'].unique().tolist()
-
-    df = df[df['Name'].isin(investorlist)]
-    df = pd.pivot_table(df, index='Name',values='valueEUR',columns='dominantCountry')
-    df.dropna()
-    df['Total'] = df.sum(axis=1)
-    for col in df.columns:
-        df[col] = df[col]/df['Total']
-
-    df = df[[col for col in df.columns[:-1]]]
-    df = df.fillna(0)
-    countrydf = df
-
-
-
-
-
-    dimlist = []
-    if 'Sector' in dimensions:
-        dimlist.append(allocdf)
-    if 'Ticket size' in dimensions:
-        dimlist.append(ticketdf)
-    if 'Deal stage' in dimensions:
-        dimlist.append(stagedf)
-    if 'Country' in dimensions:
-        dimlist.append(countrydf)
-
-    df = pd.concat(dimlist, axis=1)
-
-
-    wcss=[]
-    for i in range(1,10):
-
-        kmeans = KMeans(i)
-        kmeans.fit(df)
-        wcss_iter = kmeans.inertia_
-        wcss.append(wcss_iter)
-
-    number_clusters = range(1,10)
+    wcss, elbowtime = segment_elbow(df, elbowmethod, components)
 
     with st.expander('Show elbow chart'):
-        fig = px.line(x=number_clusters,y=wcss,title='Optimal number of clusters')
-        st.plotly_chart(fig)
+        st.plotly_chart(elbow_figure(wcss))
+
+        # Wall-clock of the fits behind each method's cached curve on these features.
+        # The expander body runs even when collapsed, so the other method is only
+        # fitted on request: on a large universe that fit is what the choice avoids
+        featurekey = (tuple(investorcat), tuple(dimensions), mindeals, ticketedges, ticketquantiles, components)
+        elbowtimes = st.session_state.setdefault('elbowtimes', {}).setdefault(featurekey, {})
+        elbowtimes[elbowmethod] = elbowtime
+        others = [method for method in ELBOW_METHODS if method not in elbowtimes]
+        if others and st.button('Time the other method ({})'.format(', '.join(others))):
+            for method in others:
+                elbowtimes[method] = segment_elbow(df, method, components)[1]
+        st.caption('{:,} investors x {:,} features'.format(*df.shape))
+        st.write(pd.DataFrame({'Seconds': elbowtimes}))
 
     st.subheader('High level view of each cluster')
 
-    kmeans = KMeans(k,random_state=42,max_iter=300)
-    kmeans.fit(df)
-    identified_clusters = kmeans.fit_predict(df)
-    df['Clusters']=identified_clusters
+    # Fitted once per features and parameters, then loaded from disk by any session
+    with profiling.stage('kmeans'):
+        clusters = cluster_investors(df, k, components)
+    df = df.assign(Clusters=clusters['labels'])
     summary = df.groupby('Clusters').mean()
 
-
-    fig = px.imshow(summary, text_auto='.2%', color_continuous_scale='greens')
-    fig.update_yaxes(tick0=0,dtick=1)
-    fig.update(layout_coloraxis_showscale=False)
-
-    st.write(fig)
+    if clusters['silhouette'] is not None:
+        st.metric('Silhouette score','{:.3f}'.format(clusters['silhouette']),
+                  help='From -1 to 1, higher is better separated; computed on up to {:,} investors'.format(SILHOUETTE_SAMPLE))
+    st.write(cluster_figure(summary))
 
 
 
@@ -552,9 +346,69 @@ with tab4:
         showdf = showdf.style.format('{:.2%}')
         st.write(showdf)
 
-    @st.cache_data
+    @profiling.tracked(st.cache_data)
     def convert_df(df):
         return df.to_csv().encode('utf-8')
     csv = convert_df(df)
 
-    st.download_button('Download data as csv',data=csv,file_name='segments.csv',mime='text/csv')
\ No newline at end of file
+    st.download_button('Download data as csv',data=csv,file_name='segments.csv',mime='text/csv')
+
+elif view == 'Time periods':
+    st.header('The market over time')
+
+    quarterlist = quarters(data)
+    if not quarterlist:
+        st.info('The deal export has no financial close dates')
+    else:
+        if len(quarterlist) > 1:
+            start,end = st.select_slider('Financial close',quarterlist,value=(quarterlist[0],quarterlist[-1]))
+        else:
+            start = end = quarterlist[0]
+        figs = time_periods_view(datainfo['key'], start, end)
+
+        st.subheader('Institutional share of market')
+        st.info('Trailing 12 months smooths the quarter to quarter swings of a few large deals')
+        st.write(figs['share'])
+
+        col1,col2 = st.columns(2)
+        with col1:
+            st.subheader('Average ticket size bank vs insto')
+            st.write(figs['tickets'])
+        with col2:
+            st.subheader('Sector allocation over the period')
+            st.write(figs['allocation'])
+
+        with st.expander('See data'):
+            st.write('Quarterly')
+            figs['quarterly']
+            st.write('Trailing 12 months, by last quarter')
+            figs['rolling']
+
+
+# Render cost of the selected view: the first render in a session includes building
+# any figures not cached yet, later ones show the cached cost
+elapsed = time.perf_counter() - viewstart
+profiling.end(viewstage)
+viewtimes = st.session_state.setdefault('viewtimes', {})
+viewtimes.setdefault(view, {'First render (s)': elapsed})['Last render (s)'] = elapsed
+with st.sidebar.expander('Render timings'):
+    st.write(pd.DataFrame(viewtimes).T)
+
+if profile:
+    run = profiling.finish()
+    profiling.write_log(run, view)
+    with st.sidebar.expander('Profiling', expanded=True):
+        st.caption('This run: {:.2f}s. Self time excludes nested stages.'.format(run['seconds']))
+        stages = pd.DataFrame(run['stages'])
+        stages['stage'] = [' ' * 4 * depth + name.rsplit(' > ', 1)[-1] for depth, name in zip(stages['depth'], stages['stage'])]
+        st.dataframe(stages[['stage', 'seconds', 'self seconds', 'process memory delta MB']].round(3), hide_index=True)
+        # Cache counts add up over the session; a cached call still shows as a stage with its lookup time
+        cachecounts = st.session_state.setdefault('cachecounts', {})
+        for name, counts in run['cache'].items():
+            total = cachecounts.setdefault(name, {'calls': 0, 'hits': 0, 'misses': 0})
+            for field in total:
+                total[field] += counts[field]
+        if cachecounts:
+            df = pd.DataFrame(cachecounts).T
+            df['hit rate'] = df['hits'] / df['calls']
+            st.dataframe(df.style.format({'hit rate': '{:.0%}'}))
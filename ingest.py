@@ -0,0 +1,305 @@
+"""Columnar ingest cache for the Inframation source workbooks.
+
+Parsing the deal workbook through openpyxl dominates a cold start of the
+dashboard. ``convert_sources()`` turns each source workbook into a typed
+Parquet file next to a small manifest holding the SHA-256 of the workbook it
+came from; ``read_source()`` loads the Parquet copy while that hash still
+matches and only falls back to Excel when the workbook changed.
+
+``normalise_lenders()`` turns the serialized ``lendersFundingValues`` lists
+of the deal table into the long lender table in one pass, and
+``deal_table()`` summarises the classified lender rows back to one row per
+deal. ``fact_table()`` slims the lender rows down to the typed columns the
+dashboard reads, with the quarter of the deal's financial close as its time
+dimension.
+
+Run ``python ingest.py`` to (re)build the cache ahead of a deployment.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+from ast import literal_eval
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from profiling import stage
+
+SOURCES = {
+    'deals': 'deals_insto_europe.xlsx',
+    'lenders': 'uniquelenders_classified_for_upload.xlsx',
+    'countries': 'uniquecountries.xlsx',
+}
+
+CACHE_DIR = '.ingest_cache'
+
+
+def file_hash(path, chunksize=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunksize), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def evict(cache_dir, max_mb):
+    """Delete the least recently used files of ``cache_dir`` until it fits in ``max_mb``.
+
+    Recency is the modification time, so readers refresh it on a hit.
+    Temporary files of writes in progress are left alone.
+    """
+    files = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and not entry.name.endswith('.tmp'):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_mb * 2**20:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def _cache_paths(name, cache_dir):
+    return (os.path.join(cache_dir, name + '.parquet'),
+            os.path.join(cache_dir, name + '.json'))
+
+
+def _columnar_types(df):
+    """Make every column storable by Parquet without pickling.
+
+    openpyxl hands back object columns mixing str with int/float wherever a
+    number was typed into a text column; those cells are stringified so the
+    column gets a single Arrow type. Numeric and date columns keep their dtype.
+    """
+    df = df.copy()
+    for col in df.columns:
+        s = df[col]
+        if not pd.api.types.is_object_dtype(s):
+            continue
+        values = s.dropna()
+        if not values.map(type).eq(str).all():
+            df[col] = s.where(s.isna(), s.astype(str))
+    return df
+
+
+def convert_source(name, path=None, cache_dir=CACHE_DIR):
+    """Parse one source workbook and store it as Parquet with its hash."""
+    path = path or SOURCES[name]
+    os.makedirs(cache_dir, exist_ok=True)
+    data_path, manifest_path = _cache_paths(name, cache_dir)
+
+    df = _columnar_types(pd.read_excel(path))
+    df.to_parquet(data_path, index=False)
+    with open(manifest_path, 'w') as f:
+        json.dump({'source': path, 'sha256': file_hash(path), 'rows': len(df)}, f)
+    return df
+
+
+def is_fresh(name, path=None, cache_dir=CACHE_DIR):
+    path = path or SOURCES[name]
+    data_path, manifest_path = _cache_paths(name, cache_dir)
+    if not (os.path.exists(data_path) and os.path.exists(manifest_path)):
+        return False
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    return manifest.get('sha256') == file_hash(path)
+
+
+def read_source(name, path=None, cache_dir=CACHE_DIR):
+    """Load a source table, from the columnar cache when it is still valid."""
+    if is_fresh(name, path, cache_dir):
+        with stage('read {} cache'.format(name)):
+            return pd.read_parquet(_cache_paths(name, cache_dir)[0])
+    with stage('parse {} workbook'.format(name)):
+        return convert_source(name, path, cache_dir)
+
+
+def source_batches(name, path=None, cache_dir=CACHE_DIR, batch_rows=50_000):
+    """Iterate over a source table in frames of ``batch_rows`` rows.
+
+    The workbook itself can only be parsed whole, once, into the columnar
+    cache; the batches are then streamed from the cache.
+    """
+    if not is_fresh(name, path, cache_dir):
+        convert_source(name, path, cache_dir)
+    for batch in pq.ParquetFile(_cache_paths(name, cache_dir)[0]).iter_batches(batch_rows):
+        yield batch.to_pandas()
+
+
+def convert_sources(cache_dir=CACHE_DIR, sources=SOURCES):
+    for name, path in sources.items():
+        if is_fresh(name, path, cache_dir):
+            print(name + ': up to date')
+        else:
+            df = convert_source(name, path, cache_dir)
+            print(name + ': converted {:,} rows'.format(len(df)))
+
+
+# A Python string literal with no escapes: repr() single-quotes it unless it
+# contains a single quote, in which case it is double-quoted.
+_PY_STRING = re.compile(r"'([^']*)'|\"([^\"]*)\"")
+
+
+def _to_json(cell):
+    """Rewrite a backslash-free Python literal with JSON string quoting."""
+    if '"' not in cell:
+        return cell.replace("'", '"')
+    return _PY_STRING.sub(lambda m: json.dumps(m.group(1) if m.group(2) is None else m.group(2)), cell)
+
+
+def _parse_cell(cell):
+    try:
+        return json.loads(_to_json(cell))
+    except ValueError:
+        return literal_eval(cell)
+
+
+def parse_funding(values):
+    """Parse a column of serialized lender lists into a list of lists.
+
+    The lists are Python reprs. Without backslashes a cell converts to JSON by
+    requoting its strings, and stays valid JSON unless it holds a Python-only
+    literal (None, True, nan, ...), which JSON rejects. So those cells are
+    joined and decoded by one ``json.loads`` call, retried cell by cell only if
+    that fails; cells with escapes go through ``literal_eval``. Missing cells
+    parse as empty lists.
+    """
+    values = pd.Series(values).reset_index(drop=True)
+    text = values.dropna().astype(str)
+    parsed = [[] for _ in range(len(values))]
+
+    escaped = text.str.contains('\\', regex=False)
+    for i, cell in text[escaped].items():
+        parsed[i] = literal_eval(cell)
+
+    text = text[~escaped]
+    try:
+        decoded = json.loads('[' + ','.join(map(_to_json, text)) + ']')
+    except ValueError:
+        decoded = map(_parse_cell, text)
+    for i, lenders in zip(text.index, decoded):
+        parsed[i] = lenders
+    return parsed
+
+
+def normalise_lenders(deals, column='lendersFundingValues'):
+    """Explode the lender lists of ``deals`` into one row per lender ticket.
+
+    Returns a frame indexed like ``deals`` (one index entry repeated per
+    lender) holding the raw record in ``column`` plus one column per record
+    key, with ``name`` as a categorical. Deals without lenders contribute no
+    rows.
+    """
+    parsed = parse_funding(deals[column])
+    counts = np.fromiter(map(len, parsed), dtype=np.int64, count=len(parsed))
+    records = list(chain.from_iterable(parsed))
+
+    lenders = pd.DataFrame.from_records(records)
+    lenders.insert(0, column, pd.Series(records, dtype=object))
+    lenders.index = deals.index.repeat(counts)
+    if 'name' in lenders:
+        lenders['name'] = lenders['name'].astype('category')
+    if 'valueEUR' in lenders:
+        lenders['valueEUR'] = pd.to_numeric(lenders['valueEUR'])
+    return lenders
+
+
+# Financial close of the deal in the export; deals without one have no quarter
+CLOSE_DATE = 'details.financialCloseDate'
+PERIOD = 'Quarter'
+
+DEAL_ATTRIBUTES = ['summary.debtsizeEUR', 'dominantSector', 'dominantCountry', 'Region', 'details.transactionType',
+                   PERIOD]
+
+DEAL_CATEGORIES = ['Bank only', 'Insto only', 'Mixed']
+
+# Lender fact table layout: categorical dimensions, float32 amounts.
+FACT_DIMENSIONS = ['name', 'Deal name', 'Deal Category', 'Bank / Insto', 'Categories', 'dominantSector',
+                   'dominantCountry', 'Region', 'details.transactionType']
+FACT_AMOUNTS = ['valueEUR', 'summary.debtsizeEUR']
+
+
+def memory_mb(df):
+    return df.memory_usage(deep=True).sum() / 2 ** 20
+
+
+def close_quarter(dates):
+    """First day of the quarter of each date, NaT where missing or unparseable."""
+    return pd.to_datetime(dates, errors='coerce').dt.to_period('Q').dt.start_time
+
+
+def fact_table(lenderdf):
+    """Copy of the lender rows keeping only the typed dashboard columns."""
+    if PERIOD not in lenderdf:
+        close = lenderdf[CLOSE_DATE] if CLOSE_DATE in lenderdf else pd.Series(pd.NaT, index=lenderdf.index)
+        lenderdf = lenderdf.assign(**{PERIOD: close_quarter(close).to_numpy()})
+    cols = [col for col in ['deal_id'] + FACT_DIMENSIONS + [PERIOD] + FACT_AMOUNTS if col in lenderdf]
+    df = lenderdf[cols].reset_index(drop=True)
+    for col in FACT_DIMENSIONS:
+        if col in df and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    for col in FACT_AMOUNTS:
+        if col in df:
+            df[col] = pd.to_numeric(df[col]).astype(np.float32)
+    return df
+
+
+def deal_table(lenderdf):
+    """Deal dimension table and the integer deal key of every lender row.
+
+    Volumes only count funded (positive) tickets. ``Deal Category`` is 'Mixed'
+    when both banks and instos funded the deal, 'Insto only' when only instos
+    did, 'Bank only' otherwise, and missing for deals with no funded ticket.
+    Returns ``(deals, key)`` where ``deals`` is indexed by the key.
+    """
+    key, names = pd.factorize(lenderdf['Deal name'])
+    key = key.astype(np.int32)
+    n = len(names)
+    valid = key >= 0
+
+    value = lenderdf['valueEUR'].to_numpy(dtype=float)
+    funded = valid & (value > 0)
+    lendertype = lenderdf['Bank / Insto'].to_numpy()
+
+    def per_deal(mask, weights=None):
+        return np.bincount(key[mask], weights=None if weights is None else weights[mask], minlength=n)
+
+    bank = per_deal(funded & (lendertype == 'Bank'), value)
+    insto = per_deal(funded & (lendertype == 'Insto'), value)
+    category = np.select([(bank > 0) & (insto > 0), insto > 0], ['Mixed', 'Insto only'], 'Bank only').astype(object)
+    category[per_deal(funded) == 0] = np.nan
+    category = pd.Categorical(category, categories=DEAL_CATEGORIES)
+
+    deals = pd.DataFrame({
+        'Deal name': names,
+        'Deal Category': category,
+        'Bank': bank,
+        'Insto': insto,
+        'Lenders': per_deal(valid),
+        'Insto lenders': per_deal(valid & (lendertype == 'Insto')),
+    })
+    deals.index.name = 'deal_id'
+    for col in DEAL_ATTRIBUTES:
+        if col in lenderdf:
+            # Deal-level columns repeat on every lender row; any row will do
+            column = lenderdf[col].to_numpy()
+            values = np.empty(n, dtype=column.dtype)
+            values[key[valid]] = column[valid]
+            deals[col] = values
+            if isinstance(lenderdf[col].dtype, pd.CategoricalDtype):
+                deals[col] = deals[col].astype(lenderdf[col].dtype)
+    return deals, key
+
+
+if __name__ == '__main__':
+    convert_sources(*sys.argv[1:2])
@@ -0,0 +1,192 @@
+"""Out-of-core lender and deal tables: partitioned Parquet queried with DuckDB.
+
+With the ``duckdb`` store backend the fact and deal tables never sit in
+memory as a whole. ``store.build_store()`` explodes the deal export a chunk
+at a time and ``append()``s each chunk to a Hive-partitioned Parquet dataset
+under the store, partitioned by year of financial close and by country. The
+functions below answer what the dashboard needs straight from a scan of that
+dataset: filters become a WHERE clause, so partitions of other years or
+countries are skipped and only the requested columns are read, and the
+group-bys run in DuckDB, so only their results reach pandas.
+"""
+
+import os
+import shutil
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from cube import MEASURES, VALUE
+from ingest import PERIOD, fact_table
+
+LAKE_DIR = 'lake'
+
+# 'year' is derived from the close quarter; deals without one go to the null partition
+PARTITIONS = ['year', 'dominantCountry']
+
+AGGREGATES = {'count': 'count({})', 'sum': 'sum({})', 'mean': 'avg({})', 'median': 'median({})'}
+
+
+def clear(lake_dir):
+    shutil.rmtree(lake_dir, ignore_errors=True)
+
+
+def append(lake_dir, table, df, chunk):
+    """Add one chunk of rows to ``table``, split into the year and country partitions."""
+    df = df.assign(year=df[PERIOD].dt.year.astype('Int16'))
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            # Plain strings: every chunk has its own categories, which would
+            # give the files different dictionary types
+            df[col] = df[col].astype(object)
+    ds.write_dataset(pa.Table.from_pandas(df, preserve_index=False), os.path.join(lake_dir, table),
+                     format='parquet', partitioning=PARTITIONS, partitioning_flavor='hive',
+                     basename_template='part-{}-{{i}}.parquet'.format(chunk),
+                     existing_data_behavior='overwrite_or_ignore')
+
+
+def size_mb(lake_dir):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(lake_dir) for f in files) / 2**20
+
+
+def _scan(lake_dir, table):
+    files = os.path.join(lake_dir, table, '**', '*.parquet').replace("'", "''")
+    return "read_parquet('{}', hive_partitioning = true)".format(files)
+
+
+def _col(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _where(where, funded):
+    clauses, params = [], []
+    for col, wanted in (where or {}).items():
+        if isinstance(wanted, (list, tuple, set)):
+            wanted = list(wanted)
+            if not wanted:
+                clauses.append('false')
+                continue
+            clauses.append('{} IN ({})'.format(_col(col), ', '.join('?' * len(wanted))))
+            params += wanted
+        else:
+            clauses.append('{} = ?'.format(_col(col)))
+            params.append(wanted)
+    if funded:
+        clauses.append('{} > 0'.format(_col(VALUE)))
+    return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+
+def _query(sql, params=()):
+    with duckdb.connect() as con:
+        return con.execute(sql, list(params)).df()
+
+
+def rows(lake_dir, where=None, columns=None, funded=False, table='lenders'):
+    """Rows matching ``where`` (dimension -> value or list), as a fact table frame."""
+    select = ', '.join(map(_col, columns)) if columns else '*'
+    clause, params = _where(where, funded)
+    df = _query('SELECT {} FROM {}{}'.format(select, _scan(lake_dir, table), clause), params)
+    if table != 'lenders':
+        return df
+    df = fact_table(df)
+    return df[columns] if columns else df
+
+
+def sums(lake_dir, by, value=VALUE, where=None, funded=False):
+    """``value`` summed per combination of ``by``, missing keys kept as their own group."""
+    keys = ', '.join(map(_col, by))
+    clause, params = _where(where, funded)
+    sql = 'SELECT {keys}, sum({v}) AS {v} FROM {scan}{where} GROUP BY {keys}'.format(
+        keys=keys, v=_col(value), scan=_scan(lake_dir, 'lenders'), where=clause)
+    return _query(sql, params)
+
+
+def top_sums(lake_dir, by, top, value=VALUE, where=None, funded=False):
+    """``sums()`` keeping the ``top`` values of the last of ``by`` per combination of the others.
+
+    The rest of each group is summed into one row labelled 'Other (n)', n
+    being the number of values folded, the way ``hierarchy.aggregate_path()``
+    folds them, so a hierarchy over millions of leaves reaches pandas already
+    cut.
+    """
+    parents, leaf = list(by[:-1]), _col(by[-1])
+    keys = ', '.join(map(_col, by))
+    partition = 'PARTITION BY {}'.format(', '.join(map(_col, parents))) if parents else ''
+    groups = ', '.join(map(_col, parents))
+    clause, params = _where(where, funded)
+    # Ties go to the smaller leaf, as in aggregate_path()
+    rank = 'row_number() OVER ({} ORDER BY {v} DESC, {} ASC NULLS LAST)'.format(partition, leaf, v=_col(value))
+    sql = ('WITH s AS (SELECT {keys}, sum({v}) AS {v} FROM {scan}{where} GROUP BY {keys}), '
+           'r AS (SELECT *, {rank} AS "rank" FROM s) '
+           'SELECT {keys}, {v} FROM r WHERE "rank" <= {top} '
+           'UNION ALL '
+           "SELECT {groupsel}'Other (' || count({leaf}) || ')' AS {leaf}, sum({v}) AS {v} "
+           'FROM r WHERE "rank" > {top}{groupby} HAVING count(*) > 0').format(
+        keys=keys, v=_col(value), scan=_scan(lake_dir, 'lenders'), where=clause, rank=rank, leaf=leaf,
+        top=int(top), groupsel=groups + ', ' if parents else '', groupby=' GROUP BY ' + groups if parents else '')
+    return _query(sql, params)
+
+
+def pivot(lake_dir, index, values, aggfunc, where=None, funded=False):
+    """``pd.pivot_table(values=values, index=index, aggfunc=aggfunc)`` over the matching rows."""
+    index = [index] if isinstance(index, str) else list(index)
+    aggs = [aggfunc] if isinstance(aggfunc, str) else list(aggfunc)
+    keys = ', '.join(map(_col, index))
+    measures = ', '.join('{} AS {}'.format(AGGREGATES[agg].format(_col(values)), _col(agg)) for agg in aggs)
+    clause, params = _where(where, funded)
+    # pivot_table drops rows with a missing key
+    notnull = ' AND '.join('{} IS NOT NULL'.format(_col(col)) for col in index)
+    clause = (clause + ' AND ' if clause else ' WHERE ') + notnull
+    sql = 'SELECT {keys}, {measures} FROM {scan}{where} GROUP BY {keys} ORDER BY {keys}'.format(
+        keys=keys, measures=measures, scan=_scan(lake_dir, 'lenders'), where=clause)
+    df = _query(sql, params).set_index(index)[aggs]
+    if isinstance(aggfunc, str):
+        df.columns = [values]
+    else:
+        df.columns = pd.MultiIndex.from_product([aggs, [values]])
+    return df
+
+
+def cube(lake_dir, dims, value=VALUE):
+    """``cube.build_cube()`` computed by the scan."""
+    derived = {'positive': 'coalesce({} > 0, false)'.format(_col(value))}
+    select = ', '.join('{} AS {}'.format(derived.get(dim, _col(dim)), _col(dim)) for dim in dims)
+    amount = 'CAST({} AS DOUBLE)'.format(_col(value))
+    sql = ('SELECT {select}, coalesce(sum({a}), 0) AS "sum", count({a}) AS "count", '
+           'coalesce(sum({a} * {a}), 0) AS "sumsq" FROM {scan} GROUP BY ALL').format(
+        select=select, a=amount, scan=_scan(lake_dir, 'lenders'))
+    df = _query(sql)
+    for dim in dims:
+        if df[dim].dtype == object:
+            df[dim] = df[dim].astype('category')
+    return df[dims + MEASURES]
+
+
+def colending_pairs(lake_dir, excluded):
+    """Mixed deals every bank/investor pair lent to together, per sector.
+
+    A self-join of the lenders of each deal, with several tickets of a
+    lender in a deal counted once; ``excluded`` investor categories are left
+    out, as in ``coinvest.build_coinvestment()``.
+    """
+    clause, params = _where({'Deal Category': 'Mixed'}, False)
+    clause += ' AND {} IS NOT NULL'.format(_col(VALUE))
+    if excluded:
+        clause += ' AND (Categories IS NULL OR Categories NOT IN ({}))'.format(', '.join('?' * len(excluded)))
+        params += list(excluded)
+    sql = ('WITH t AS (SELECT DISTINCT "Deal name" AS deal, "dominantSector" AS sector, name, "Bank / Insto" AS kind '
+           'FROM {scan}{where}) '
+           'SELECT b.sector AS "Sector", b.name AS "Bank", i.name AS "Insto", count(DISTINCT b.deal) AS "Deals" '
+           'FROM t AS b JOIN t AS i ON b.deal = i.deal AND b.sector = i.sector '
+           "WHERE b.kind = 'Bank' AND i.kind = 'Insto' GROUP BY ALL").format(
+        scan=_scan(lake_dir, 'lenders'), where=clause)
+    return _query(sql, params)
+
+
+def deal_summary(lake_dir):
+    """Deal count per category and number of deals with an institutional lender."""
+    sql = ('SELECT "Deal Category", count(*) AS deals, count(*) FILTER ("Insto lenders" > 0) AS instodeals '
+           'FROM {} GROUP BY ALL').format(_scan(lake_dir, 'deals'))
+    return _query(sql)
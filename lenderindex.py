@@ -0,0 +1,86 @@
+"""Exact lender lookup by name or alias.
+
+Each classified lender is a canonical entity, identified by its ``ID`` in the
+classification file. ``build_index()`` maps every entity to its aliases and to
+the positions of its rows in the lender fact table, so looking a lender up is
+a dict hit plus a slice of its own rows instead of a substring scan over all
+of them. Aliases are the full name, the name without its bracketed parts and
+each bracketed part less any 'formerly': 'Norddeutsche Landesbank
+Girozentrale (NORD/LB)' also answers to 'Norddeutsche Landesbank
+Girozentrale' and 'NORD/LB'. Matching ignores case and repeated spaces; an
+alias shared by two lenders is dropped, a full name always resolves to its
+own lender.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+_BRACKETED = re.compile(r'\(([^)]*)\)')
+_FORMERLY = re.compile(r'^\s*(formerly|previously):?\s+', re.IGNORECASE)
+
+
+def _key(text):
+    return ' '.join(str(text).casefold().split())
+
+
+def aliases(name):
+    found = [name, _BRACKETED.sub('', name)]
+    for inner in _BRACKETED.findall(name):
+        found.append(_FORMERLY.sub('', inner))
+    return list(dict.fromkeys(alias.strip() for alias in found if alias.strip()))
+
+
+def build_index(lenderdf, classified, present=None):
+    """Entity index over ``lenderdf`` rows, whose categorical ``name`` holds classified names.
+
+    Without ``lenderdf`` (the fact table is out of core) the index only
+    resolves names; ``present`` then lists the lenders that have rows.
+    """
+    classified = classified.drop_duplicates('Name')
+    names = classified['Name'].astype(str).to_numpy()
+
+    owners = {}
+    for pos, name in enumerate(names):
+        for alias in aliases(name)[1:]:
+            owners.setdefault(_key(alias), set()).add(pos)
+    lookup = {key: owner.pop() for key, owner in owners.items() if len(owner) == 1}
+    lookup.update((_key(name), pos) for pos, name in enumerate(names))
+
+    if lenderdf is None:
+        return {'ids': classified['ID'].to_numpy(), 'names': names, 'aliases': lookup,
+                'present': pd.Index(names).isin(present), 'order': None, 'offsets': None}
+
+    # Rows grouped by entity: entity i owns order[offsets[i]:offsets[i + 1]]
+    categories = pd.Index(names).get_indexer(lenderdf['name'].cat.categories)
+    codes = lenderdf['name'].cat.codes.to_numpy()
+    entity = np.where(codes >= 0, categories[codes], -1)
+    order = np.argsort(entity, kind='stable')
+    offsets = np.searchsorted(entity[order], np.arange(len(names) + 1))
+
+    return {'ids': classified['ID'].to_numpy(), 'names': names, 'aliases': lookup,
+            'present': np.diff(offsets) > 0, 'order': order, 'offsets': offsets}
+
+
+def present_names(index):
+    """Canonical names of the lenders that have rows, in classification order."""
+    return index['names'][index['present']].tolist()
+
+
+def resolve(index, lender):
+    """Position of the entity named or aliased ``lender``, None if unknown."""
+    return index['aliases'].get(_key(lender))
+
+
+def canonical_name(index, lender):
+    pos = resolve(index, lender)
+    return None if pos is None else index['names'][pos]
+
+
+def lender_rows(index, lender):
+    """Fact table row positions of ``lender``, in table order."""
+    pos = resolve(index, lender)
+    if pos is None:
+        return np.empty(0, dtype=np.intp)
+    return index['order'][index['offsets'][pos]:index['offsets'][pos + 1]]
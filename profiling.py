@@ -0,0 +1,167 @@
+"""Opt-in profiling of the app's hot paths.
+
+Enabled with ``?profile=1`` in the app URL or ``INFRAMATION_PROFILE=1`` in the
+environment. While a run is profiled, every ``stage()`` block records its wall
+time and the change in traced memory, and functions cached through
+``tracked()`` count their calls and misses. Stages nest: a stage opened inside
+another is recorded as ``outer > inner``.
+
+Nothing is recorded outside a profiled run, so the stages can stay in the
+ingest and analytics code at no cost. State is per thread, which is per
+session in Streamlit. Memory tracing is the exception: tracemalloc is
+process-wide, so it runs, and slows allocation for every session, while any
+profiled run is in progress, and the memory deltas include what other
+threads allocated meanwhile.
+"""
+
+import contextlib
+import datetime
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+ENV = 'INFRAMATION_PROFILE'
+
+# Next to the ingest cache, which is not checked in
+LOG = os.path.join('.ingest_cache', 'profile.jsonl')
+
+SLOWEST = 10
+
+_local = threading.local()
+
+# Threads with a profiled run in progress; tracing stops once none is left
+_profiled = set()
+_lock = threading.Lock()
+_tracing = False
+
+
+def env_enabled():
+    return os.environ.get(ENV, '').lower() not in ('', '0', 'false', 'no')
+
+
+def start():
+    """Begin recording a run on this thread."""
+    global _tracing
+    with _lock:
+        _profiled.add(threading.current_thread())
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing = True
+    _local.run = {'start': time.perf_counter(), 'stages': [], 'cache': {}}
+    _local.stack = []
+
+
+def _current():
+    return getattr(_local, 'run', None)
+
+
+def begin(name):
+    """Open a stage; pair with ``end()`` where a ``with`` block does not fit."""
+    run = _current()
+    if run is None:
+        return None
+    _local.stack.append(name)
+    return (run, ' > '.join(_local.stack), tracemalloc.get_traced_memory()[0], time.perf_counter())
+
+
+def end(token):
+    if token is None:
+        return
+    run, path, memory, start = token
+    run['stages'].append({
+        'stage': path,
+        'depth': len(_local.stack) - 1,
+        'offset': start - run['start'],
+        'seconds': time.perf_counter() - start,
+        'process memory delta MB': (tracemalloc.get_traced_memory()[0] - memory) / 2**20,
+    })
+    _local.stack.pop()
+
+
+@contextlib.contextmanager
+def stage(name):
+    token = begin(name)
+    try:
+        yield
+    finally:
+        end(token)
+
+
+def _count(name, field):
+    run = _current()
+    if run is not None:
+        counts = run['cache'].setdefault(name, {'calls': 0, 'misses': 0})
+        counts[field] += 1
+
+
+def tracked(cache):
+    """Apply a Streamlit cache decorator, counting hits and misses while profiling.
+
+        @tracked(st.cache_data(max_entries=1))
+        def get_data(dataset): ...
+
+    The cached function only runs on a miss, so calls minus misses are hits.
+    Both wrappers keep the function's name and source, which Streamlit keys
+    the cache on.
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def compute(*args, **kwargs):
+            _count(fn.__name__, 'misses')
+            return fn(*args, **kwargs)
+
+        cached = cache(compute)
+
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            _count(fn.__name__, 'calls')
+            with stage(fn.__name__):
+                return cached(*args, **kwargs)
+
+        call.clear = cached.clear
+        return call
+    return decorate
+
+
+def finish():
+    """Stop recording and return the run with each stage's own (self) time."""
+    global _tracing
+    run = _current()
+    _local.run = None
+    with _lock:
+        # Runs cut short (st.stop, a rerun) never finish, but their threads end
+        _profiled.discard(threading.current_thread())
+        _profiled.difference_update([thread for thread in _profiled if not thread.is_alive()])
+        # Tracing started outside this module is left running
+        if _tracing and not _profiled:
+            tracemalloc.stop()
+            _tracing = False
+    if run is None:
+        return None
+    stages = sorted(run['stages'], key=lambda s: s['offset'])
+    for s in stages:
+        children = [c for c in stages if c['depth'] == s['depth'] + 1 and c['stage'].startswith(s['stage'] + ' > ')
+                    and s['offset'] <= c['offset'] < s['offset'] + s['seconds']]
+        s['self seconds'] = s['seconds'] - sum(c['seconds'] for c in children)
+    run['stages'] = stages
+    run['seconds'] = time.perf_counter() - run['start']
+    for counts in run['cache'].values():
+        counts['hits'] = counts['calls'] - counts['misses']
+    return run
+
+
+def write_log(run, label, path=LOG, slowest=SLOWEST):
+    """Append the run's slowest stages by self time to a JSON lines log."""
+    stages = sorted(run['stages'], key=lambda s: s['self seconds'], reverse=True)[:slowest]
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(json.dumps({
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'run': label,
+            'seconds': run['seconds'],
+            'slowest': [{k: s[k] for k in ('stage', 'self seconds', 'seconds', 'process memory delta MB')} for s in stages],
+            'cache': run['cache'],
+        }) + '\n')
@@ -0,0 +1,90 @@
+"""Data quality checks and region enrichment for the deal export.
+
+The processing keeps only what it can place: tickets of lenders in the
+classification file and deals with a positive debt size. ``check()`` counts
+what falls out, for a whole batch of deals at once: unmatched lender names,
+deals without a positive debt size and countries missing from the country
+table. Counts of several batches add up with ``combine()``, and
+``summary()`` condenses them into the small report the store keeps in its
+manifest. ``regions()`` maps the deal countries onto the country table's
+regions.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Names listed per check in the report; the counts cover all of them
+TOP = 20
+
+
+def _key(values):
+    return pd.Index(values).astype(str).str.strip().str.casefold()
+
+
+def regions(country, countries):
+    """Region of each country as a categorical, missing where the country is unknown."""
+    lookup = pd.Series(countries['Sub_Region'].to_numpy(), index=_key(countries['Country']))
+    lookup = lookup[~lookup.index.duplicated()]
+    country = country.astype('category')
+    # One lookup per distinct country, then a take by code
+    region = lookup.reindex(_key(country.cat.categories)).to_numpy(dtype=object)
+    codes = country.cat.codes.to_numpy()
+    values = np.where(codes >= 0, region[codes], None)
+    return pd.Series(pd.Categorical(values, categories=sorted(lookup.unique())), index=country.index)
+
+
+def check(deals, lenderrows, lenders, countries):
+    """Counts of what one batch loses: ``lenderrows`` are its exploded tickets."""
+    unmatched = lenderrows[~lenderrows['name'].isin(lenders['Name'])]
+    unmatched = unmatched.groupby('name', observed=True)['valueEUR'].agg(['size', 'sum'])
+    # Plain labels, so batches with different categories combine
+    unmatched.index = unmatched.index.astype(object)
+
+    debt = pd.to_numeric(deals['summary.debtsizeEUR'], errors='coerce')
+    zero = ~(debt > 0)
+
+    country = deals['dominantCountry']
+    unknown = ~_key(country.fillna('')).isin(_key(countries['Country']))
+    unknown = country[unknown].fillna('(missing)').value_counts()
+
+    return {
+        'deals': len(deals),
+        'lender rows': len(lenderrows),
+        'unmatched': unmatched,
+        'zero-value deals': int(zero.sum()),
+        'zero-value examples': deals.loc[zero, 'Deal name'].head(TOP).tolist(),
+        'unknown countries': unknown,
+    }
+
+
+def combine(a, b):
+    """Counts of two batches together."""
+    if a is None:
+        return b
+    return {
+        'deals': a['deals'] + b['deals'],
+        'lender rows': a['lender rows'] + b['lender rows'],
+        'unmatched': pd.concat([a['unmatched'], b['unmatched']]).groupby(level=0).sum(),
+        'zero-value deals': a['zero-value deals'] + b['zero-value deals'],
+        'zero-value examples': (a['zero-value examples'] + b['zero-value examples'])[:TOP],
+        'unknown countries': pd.concat([a['unknown countries'], b['unknown countries']]).groupby(level=0).sum(),
+    }
+
+
+def summary(counts, top=TOP):
+    """JSON-ready report: totals plus the ``top`` largest offenders of each check."""
+    unmatched = counts['unmatched'].sort_values(['size', 'sum'], ascending=False)
+    unknown = counts['unknown countries'].sort_values(ascending=False)
+    return {
+        'deals': int(counts['deals']),
+        'lender rows': int(counts['lender rows']),
+        'unmatched lender rows': int(unmatched['size'].sum()),
+        'unmatched lender value mEUR': float(unmatched['sum'].sum()),
+        'unmatched lenders': int(len(unmatched)),
+        'zero-value deals': int(counts['zero-value deals']),
+        'deals with unknown country': int(unknown.sum()),
+        'top unmatched lenders': [{'name': str(name), 'rows': int(row['size']), 'valueEUR': float(row['sum'])}
+                                  for name, row in unmatched.head(top).iterrows()],
+        'zero-value examples': [str(name) for name in counts['zero-value examples'][:top]],
+        'top unknown countries': [{'country': str(name), 'deals': int(n)} for name, n in unknown.head(top).items()],
+    }
@@ -0,0 +1,212 @@
+"""Investor segmentation features for the tab4 clustering.
+
+``feature_matrix()`` filters the lender table once for a choice of investor
+categories and minimum deal count, then builds the share matrices for the
+requested dimensions from that shared frame. Tickets are bucketed by size in
+one ``pd.cut()`` over that frame, at fixed edges or at quantiles of the
+eligible tickets. ``elbow_curve()`` computes the within-cluster sum of
+squares for a range of k. Both are pure functions of their inputs so the app
+can memoize them.
+
+``cluster_investors()`` fits KMeans once per feature matrix and parameters,
+optionally on the first principal components of a wide matrix (many
+countries), and keeps the fit and the assignments on disk so a repeat of the
+same request, from any session or process, loads them instead of refitting.
+The least recently used fits are deleted beyond ``MODEL_MB``. Its silhouette
+score is computed on a sample of investors.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import joblib
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.decomposition import PCA
+from sklearn.metrics import silhouette_score
+
+from ingest import CACHE_DIR, evict
+
+DIMENSIONS = ['Sector', 'Ticket size', 'Deal stage', 'Country']
+
+ELBOW_METHODS = ['KMeans', 'MiniBatchKMeans']
+
+MODEL_DIR = os.path.join(CACHE_DIR, 'clusters')
+# Beyond this the least recently used fits are deleted
+MODEL_MB = 256
+
+# Investors the silhouette score is computed on; it is quadratic in their number
+SILHOUETTE_SAMPLE = 2000
+
+RANDOM_STATE = 42
+
+# Upper bounds in mEUR of every ticket bucket but the last
+TICKET_EDGES = [60, 100]
+STAGES = ['Greenfield', 'Additional Financing', 'Refinancing']
+
+
+def ticket_edges(tickets, edges=TICKET_EDGES, quantiles=None):
+    """Sorted bucket edges; with ``quantiles``, those splitting ``tickets`` into that many equal buckets."""
+    if quantiles:
+        # Repeated quantiles (many equal tickets) collapse into one edge
+        edges = tickets.quantile(np.linspace(0, 1, quantiles + 1)[1:-1])
+    return sorted(set(float(edge) for edge in edges))
+
+
+def ticket_labels(edges):
+    if not edges:
+        return ['All tickets']
+    return ['Less than {:g}'.format(edge) for edge in edges] + ['More than {:g}'.format(edges[-1])]
+
+
+def ticket_buckets(tickets, edges):
+    """Categorical bucket of every ticket, upper edges inclusive."""
+    return pd.cut(tickets, [-np.inf] + list(edges) + [np.inf], labels=ticket_labels(edges))
+
+
+def eligible_tickets(lenderdf, investorcat, mindeals):
+    """Funded non bank-only tickets of investors with at least ``mindeals`` of them."""
+    df = lenderdf[(lenderdf['Categories'].isin(investorcat)) & (lenderdf['Deal Category'] != 'Bank only')
+                  & (lenderdf['valueEUR'] > 0)]
+    counts = df.groupby('name', observed=True)['valueEUR'].count()
+    return df[df['name'].isin(counts.index[counts >= mindeals])]
+
+
+def _shares(df, columns, aggfunc):
+    """Per-investor pivot normalised so each row sums to one."""
+    df = pd.pivot_table(df, index='name', values='valueEUR', columns=columns, aggfunc=aggfunc, observed=True)
+    df.index = df.index.astype(object)
+    df.columns = df.columns.astype(object)
+    return df.div(df.sum(axis=1), axis=0).fillna(0)
+
+
+def dimension_frame(df, dimension):
+    if dimension == 'Sector':
+        return _shares(df, 'dominantSector', 'mean')
+    if dimension == 'Ticket size':
+        buckets = df['Ticket bucket'].cat.categories.tolist()
+        return _shares(df, 'Ticket bucket', 'count').reindex(columns=buckets, fill_value=0)
+    if dimension == 'Deal stage':
+        return _shares(df, 'details.transactionType', 'sum').reindex(columns=STAGES, fill_value=0)
+    if dimension == 'Country':
+        return _shares(df, 'dominantCountry', 'mean')
+    raise ValueError('Unknown segmentation dimension: {}'.format(dimension))
+
+
+def feature_matrix(lenderdf, investorcat, dimensions, mindeals, ticketedges=TICKET_EDGES, ticketquantiles=None):
+    """Concatenated share matrices, one row per eligible investor."""
+    df = eligible_tickets(lenderdf, investorcat, mindeals)
+    if 'Ticket size' in dimensions:
+        edges = ticket_edges(df['valueEUR'], ticketedges, ticketquantiles)
+        df = df.assign(**{'Ticket bucket': ticket_buckets(df['valueEUR'], edges)})
+    frames = [dimension_frame(df, dim) for dim in DIMENSIONS if dim in dimensions]
+    return pd.concat(frames, axis=1).fillna(0)
+
+
+def _inertia(X, k):
+    return KMeans(k).fit(X).inertia_
+
+
+def _minibatch_elbow(X, kmax, batch_size=4096, random_state=42):
+    """MiniBatchKMeans inertias, each k seeded from the k - 1 solution.
+
+    The extra centre is drawn with probability proportional to the squared
+    distance to the current centres (one k-means++ step), so every fit starts
+    close to a good partition and needs a single initialisation.
+    """
+    rng = np.random.default_rng(random_state)
+    wcss = []
+    centers = X[[rng.integers(len(X))]]
+    for k in range(1, kmax + 1):
+        if k > 1:
+            dist = ((X - centers[model.labels_]) ** 2).sum(axis=1)
+            if not dist.sum() > 0:
+                # Every row sits on a centre (fewer distinct rows than k): no fit can do better
+                wcss += [wcss[-1]] * (kmax - len(wcss))
+                break
+            centers = np.vstack([centers, X[rng.choice(len(X), p=dist / dist.sum())]])
+        model = MiniBatchKMeans(k, init=centers, n_init=1, batch_size=batch_size,
+                                random_state=random_state).fit(X)
+        centers = model.cluster_centers_
+        wcss.append(model.inertia_)
+    return wcss
+
+
+def elbow_curve(features, kmax=9, method='KMeans', n_jobs=-1):
+    """Inertia of a fit for every k from 1 to ``kmax``.
+
+    ``method='KMeans'`` fits the candidate k concurrently on a joblib process
+    pool, which memory-maps the feature matrix into the workers rather than
+    copying it per task. ``'MiniBatchKMeans'`` runs the warm-started
+    mini-batch fits sequentially, for large investor universes.
+    """
+    X = np.ascontiguousarray(features, dtype=np.float64)
+    kmax = min(kmax, len(X))
+    if method == 'MiniBatchKMeans':
+        return _minibatch_elbow(X, kmax)
+    if method != 'KMeans':
+        raise ValueError('Unknown elbow method: {}'.format(method))
+    return Parallel(n_jobs=n_jobs)(delayed(_inertia)(X, k) for k in range(1, kmax + 1))
+
+
+def reduce_features(features, components=None):
+    """Features as an array, projected on their first ``components`` principal components if given."""
+    X = np.ascontiguousarray(features, dtype=np.float64)
+    if not components or components >= min(X.shape):
+        return X, None
+    pca = PCA(components, random_state=RANDOM_STATE)
+    return pca.fit_transform(X), pca
+
+
+def silhouette(X, labels, sample=SILHOUETTE_SAMPLE):
+    """Silhouette score over at most ``sample`` rows, None when undefined."""
+    if not 1 < len(np.unique(labels)) < len(X):
+        return None
+    return float(silhouette_score(X, labels, sample_size=min(sample, len(X)), random_state=RANDOM_STATE))
+
+
+def _model_key(features, k, components):
+    h = hashlib.sha256(pd.util.hash_pandas_object(features).to_numpy().tobytes())
+    h.update(json.dumps([list(map(str, features.columns)), k, components, RANDOM_STATE]).encode())
+    return h.hexdigest()[:20]
+
+
+def cluster_investors(features, k, components=None, model_dir=MODEL_DIR, max_mb=MODEL_MB):
+    """KMeans clusters of the investors (rows) of ``features``, fitted once.
+
+    Returns ``{'model', 'reduction', 'labels', 'silhouette'}``: the fitted
+    KMeans, the PCA it was fitted on (None without ``components``), the
+    cluster of every investor as a Series indexed like ``features`` and the
+    sampled silhouette score. Results are kept in ``model_dir`` under a hash
+    of the features and parameters, at most ``max_mb`` of them;
+    ``model_dir=None`` skips that.
+    """
+    path = os.path.join(model_dir, _model_key(features, k, components) + '.joblib') if model_dir else None
+    if path:
+        try:
+            result = joblib.load(path)
+            os.utime(path)
+            return result
+        except (OSError, EOFError):
+            # Not fitted yet, or evicted meanwhile
+            pass
+
+    X, reduction = reduce_features(features, components)
+    model = KMeans(k, random_state=RANDOM_STATE, max_iter=300)
+    labels = model.fit_predict(X)
+    result = {'model': model, 'reduction': reduction, 'silhouette': silhouette(X, labels),
+              'labels': pd.Series(labels, index=features.index, name='Clusters')}
+
+    if path:
+        os.makedirs(model_dir, exist_ok=True)
+        # A file of its own, as other sessions may be fitting the same parameters
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=model_dir)
+        with os.fdopen(fd, 'wb') as f:
+            joblib.dump(result, f)
+        os.replace(tmp, path)
+        evict(model_dir, max_mb)
+    return result
@@ -0,0 +1,368 @@
+"""Processed dataset store with incremental deal updates.
+
+The store holds what ``get_data()`` needs in processed form: the lender fact
+table, the deal table and the additive aggregate cubes, as uncompressed Arrow
+IPC files next to a manifest. ``load_store()`` memory-maps them instead of
+reading them: numeric columns and category codes stay views of the file's
+pages, which the OS shares between every worker process, so another worker
+or a reload costs little more than the category labels. ``ensure_store()``
+(re)builds it from the source workbooks when they change. ``apply_delta()``
+merges a weekly export of new or amended deals without a rebuild: the delta
+deals are processed on their own, their rows replace any stored rows of the
+same deals, and the cubes are updated by subtracting the old rows and adding
+the new ones.
+
+Every build or delta bumps the manifest version and changes its
+``dataset_key()``, which the app passes to its cached loader so Streamlit
+drops the stale dataset. Each version is written to a directory of its own and
+the manifest, replaced atomically, is switched to it last, so a reader sees
+either the old tables or the new ones, never a mix. Files of a version are
+never replaced in place, which Windows refuses while a running app maps them;
+older versions are deleted once nothing holds them, keeping the previous one
+for readers of the old manifest. The manifest also holds the quality report of
+the export (see ``quality.py``): what the processing dropped and which
+countries it could not place in a region.
+
+The ``duckdb`` backend (``INFRAMATION_BACKEND=duckdb`` or ``build --backend
+duckdb``) is for histories that do not fit in memory: the fact and deal tables
+are written chunk by chunk to a partitioned Parquet lake instead (see
+``lake.py``), only the cubes are kept as plain tables, and deltas are not
+supported.
+
+    python store.py build
+    python store.py append new_deals.xlsx
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+
+import lake
+import quality
+from cube import LENDER_DIMS, MARKET_DIMS, PERIOD_DIMS, SUNBURST_DIMS, build_cube, update_cube
+from ingest import (CACHE_DIR, SOURCES, deal_table, fact_table, file_hash, memory_mb, normalise_lenders,
+                    read_source, source_batches)
+from profiling import stage
+
+STORE_DIR = os.path.join(CACHE_DIR, 'store')
+
+BACKENDS = ['pandas', 'duckdb']
+# Unset: a new store uses pandas and an existing one keeps its backend
+BACKEND = os.environ.get('INFRAMATION_BACKEND')
+
+# Deals exploded at a time by the duckdb backend
+CHUNK_DEALS = 50_000
+
+DEAL_KEY = 'Deal name'
+
+CUBES = {'marketcube': MARKET_DIMS, 'lendercube': LENDER_DIMS, 'sunburst': SUNBURST_DIMS, 'periodcube': PERIOD_DIMS}
+TABLES = ['lenders', 'deals'] + list(CUBES)
+
+# Stores written as Parquet before are rebuilt
+FORMAT = 'arrow'
+# Bumped when the stored tables change columns or cubes, so older stores are rebuilt
+SCHEMA = 2
+
+
+def process(deals, lenders, countries):
+    """Deal export rows -> (lender fact table, deal table, MB before slimming, quality counts)."""
+    with stage('explode lenders'):
+        tickets = normalise_lenders(deals)
+    with stage('validate'):
+        counts = quality.check(deals, tickets, lenders, countries)
+        deals = deals.assign(Region=quality.regions(deals['dominantCountry'], countries))
+    lenderdf = deals.drop(columns='lendersFundingValues').join(tickets)
+    with stage('merge classification'):
+        lenderdf = lenderdf.merge(lenders, left_on='name', right_on='Name')
+    before = memory_mb(lenderdf)
+    with stage('fact table'):
+        lenderdf = fact_table(lenderdf)
+
+    with stage('deal table'):
+        dealdf, lenderdf['deal_id'] = deal_table(lenderdf)
+    lenderdf['Deal Category'] = dealdf['Deal Category'].take(lenderdf['deal_id']).array
+
+    lenderdf = lenderdf[lenderdf['summary.debtsizeEUR'] > 0].reset_index(drop=True)
+    dealdf = dealdf[dealdf['summary.debtsizeEUR'] > 0]
+    return lenderdf, dealdf, before, counts
+
+
+def _manifest_path(store_dir):
+    return os.path.join(store_dir, 'manifest.json')
+
+
+def read_manifest(store_dir=STORE_DIR):
+    path = _manifest_path(store_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _replace(path, write):
+    # Written aside under a name of its own, then renamed over the old file
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+    os.close(fd)
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _write_manifest(manifest, store_dir):
+    def write(path):
+        with open(path, 'w') as f:
+            json.dump(manifest, f, indent=1)
+    _replace(_manifest_path(store_dir), write)
+
+
+def _write_table(df, path):
+    table = pa.Table.from_pandas(df)
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def _map_table(path):
+    """Frame over the memory-mapped file, without copying what pandas can share."""
+    # split_blocks: no consolidation of same-typed columns into a new block
+    return pa.ipc.open_file(pa.memory_map(path)).read_all().to_pandas(split_blocks=True)
+
+
+def _version_dir(store_dir, manifest):
+    # Stores written before versions had directories keep their tables at the top
+    return os.path.join(store_dir, manifest.get('directory', ''))
+
+
+def _new_version(store_dir, version):
+    """Empty directory for the tables of ``version``, left over from an interrupted write or not."""
+    directory = 'v{}'.format(version)
+    path = os.path.join(store_dir, directory)
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    return directory
+
+
+def _prune(store_dir, keep):
+    # Best effort: on Windows a version still mapped by a running app stays
+    # until a later write finds it released
+    for entry in os.scandir(store_dir):
+        if entry.name in keep:
+            continue
+        if entry.is_dir() and entry.name[:1] == 'v' and entry.name[1:].isdigit():
+            shutil.rmtree(entry.path, ignore_errors=True)
+        elif entry.is_file() and entry.name.endswith(('.arrow', '.parquet')):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+    lake.clear(os.path.join(store_dir, lake.LAKE_DIR))
+
+
+def _write(tables, manifest, store_dir, previous=None):
+    """Write ``tables`` into the version directory named by the manifest, then switch the manifest."""
+    directory = _version_dir(store_dir, manifest)
+    for name, df in tables.items():
+        _write_table(df, os.path.join(directory, name + '.arrow'))
+    # Manifest last: readers only see a version once its tables are in place
+    _write_manifest(manifest, store_dir)
+    _prune(store_dir, {manifest['directory'], (previous or {}).get('directory')})
+
+
+def load_store(store_dir=STORE_DIR, manifest=None):
+    """The tables of the manifest's version, read-only; only the cubes with the duckdb backend."""
+    manifest = manifest or read_manifest(store_dir)
+    names = list(CUBES) if lake_dir(store_dir, manifest) else TABLES
+    directory = _version_dir(store_dir, manifest)
+    return {name: _map_table(os.path.join(directory, name + '.arrow')) for name in names}
+
+
+def dataset_key(manifest):
+    """Short key of the stored dataset, unlike the version unique across rebuilds."""
+    identity = [manifest['version'], manifest.get('build'), manifest.get('schema'), manifest.get('backend'),
+                sorted((name, source['sha256']) for name, source in manifest['sources'].items()),
+                [delta['sha256'] for delta in manifest['deltas']]]
+    return '{}-{}'.format(manifest['version'], hashlib.sha256(json.dumps(identity).encode()).hexdigest()[:12])
+
+
+def lake_dir(store_dir=STORE_DIR, manifest=None):
+    """Directory of the partitioned fact and deal tables, None with the pandas backend."""
+    manifest = manifest or read_manifest(store_dir) or {}
+    if manifest.get('backend', 'pandas') != 'duckdb':
+        return None
+    return os.path.join(_version_dir(store_dir, manifest), lake.LAKE_DIR)
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _build_lake(directory, sources, chunk_deals):
+    # Peak memory is one chunk of deals: each is exploded, classified and
+    # appended to the lake on its own, with deal ids offset past the previous ones
+    lakedir = os.path.join(directory, lake.LAKE_DIR)
+    lenders = read_source('lenders', sources['lenders'])
+    countries = read_source('countries', sources['countries'])
+    offset, before, counts = 0, 0.0, None
+    for chunk, deals in enumerate(source_batches('deals', sources['deals'], batch_rows=chunk_deals)):
+        fact, dealdf, mb, chunkcounts = process(deals, lenders, countries)
+        counts = quality.combine(counts, chunkcounts)
+        fact['deal_id'] += offset
+        dealdf.index += offset
+        if len(fact):
+            lake.append(lakedir, 'lenders', fact, chunk)
+            lake.append(lakedir, 'deals', dealdf.reset_index(), chunk)
+        offset += len(deals)
+        before = max(before, mb)
+
+    with stage('cubes'):
+        tables = {name: lake.cube(lakedir, dims) for name, dims in CUBES.items()}
+    return tables, offset, before, counts
+
+
+def build_store(store_dir=STORE_DIR, sources=SOURCES, backend=BACKEND, chunk_deals=CHUNK_DEALS):
+    """Full rebuild from the source workbooks."""
+    backend = backend or 'pandas'
+    if backend not in BACKENDS:
+        raise ValueError('Unknown store backend: {}'.format(backend))
+    previous = read_manifest(store_dir) or {}
+    version = previous.get('version', 0) + 1
+    directory = _new_version(store_dir, version)
+    if backend == 'duckdb':
+        tables, next_deal_id, before, counts = _build_lake(os.path.join(store_dir, directory), sources, chunk_deals)
+    elif backend == 'pandas':
+        lenders, deals, before, counts = process(read_source('deals', sources['deals']),
+                                                 read_source('lenders', sources['lenders']),
+                                                 read_source('countries', sources['countries']))
+        tables = {'lenders': lenders, 'deals': deals}
+        with stage('cubes'):
+            for name, dims in CUBES.items():
+                tables[name] = build_cube(lenders, dims)
+        next_deal_id = int(deals.index.max()) + 1 if len(deals) else 0
+
+    manifest = {
+        'version': version,
+        # Tells apart two builds of the same version, e.g. after the store was deleted
+        'build': uuid.uuid4().hex,
+        'directory': directory,
+        'format': FORMAT,
+        'schema': SCHEMA,
+        'backend': backend,
+        'sources': {name: {'sha256': file_hash(path), 'signature': _signature(path)}
+                    for name, path in sources.items() if name in ('deals', 'lenders', 'countries')},
+        'deltas': [],
+        'next_deal_id': next_deal_id,
+        'memory_before_mb': before,
+        'quality': quality.summary(counts),
+    }
+    _write(tables, manifest, store_dir, previous)
+    return manifest
+
+
+def _stale(manifest, sources, store_dir):
+    touched = False
+    for name, recorded in manifest['sources'].items():
+        path = sources[name]
+        if _signature(path) == recorded['signature']:
+            continue
+        if file_hash(path) != recorded['sha256']:
+            return True
+        recorded['signature'] = _signature(path)
+        touched = True
+    if touched:
+        # Same content under a new mtime: remember it so it is not rehashed on every run
+        _write_manifest(manifest, store_dir)
+    return False
+
+
+def ensure_store(store_dir=STORE_DIR, sources=SOURCES, backend=BACKEND):
+    """``dataset_key()`` of an up-to-date store, rebuilding it if a source or the backend changed.
+
+    A changed source workbook is a new full export, so it supersedes any
+    deltas applied on top of the previous one. The key, not the version, is
+    what caches should be keyed on: versions restart at 1 when the store
+    directory is removed.
+    """
+    manifest = read_manifest(store_dir)
+    if manifest is not None:
+        backend = backend or manifest.get('backend', 'pandas')
+    if (manifest is None or manifest.get('format') != FORMAT or manifest.get('schema') != SCHEMA
+            or manifest.get('backend', 'pandas') != backend or _stale(manifest, sources, store_dir)):
+        with stage('build store'):
+            manifest = build_store(store_dir, sources, backend)
+    return dataset_key(manifest)
+
+
+def apply_delta(path, store_dir=STORE_DIR, sources=SOURCES, key=DEAL_KEY):
+    """Merge an export of new or amended deals into the store.
+
+    ``path`` is a workbook (or Parquet file) shaped like the deal export. Any
+    deal it names is replaced as a whole, so an amended deal lists all of its
+    lenders. Returns the new manifest.
+    """
+    ensure_store(store_dir, sources)
+    manifest = read_manifest(store_dir)
+    if lake_dir(store_dir, manifest):
+        raise ValueError('Deltas cannot be applied to a duckdb store; rebuild it from a new export')
+    digest = file_hash(path)
+    if any(delta['sha256'] == digest for delta in manifest['deltas']):
+        return manifest
+
+    delta = pd.read_parquet(path) if path.endswith('.parquet') else pd.read_excel(path)
+    added, newdeals, _, counts = process(delta, read_source('lenders', sources['lenders']),
+                                         read_source('countries', sources['countries']))
+
+    tables = load_store(store_dir, manifest)
+    lenders, deals = tables['lenders'], tables['deals']
+    affected = lenders[key].isin(delta[key])
+    removed = lenders[affected]
+
+    # Amended deals keep their deal_id, new deals get fresh ones
+    known = pd.Series(deals.index, index=deals[key].astype(object))
+    known = known[~known.index.duplicated()]
+    ids = newdeals[key].astype(object).map(known)
+    fresh = ids.isna()
+    ids[fresh] = range(manifest['next_deal_id'], manifest['next_deal_id'] + int(fresh.sum()))
+    ids = ids.astype('int32')
+    added['deal_id'] = added['deal_id'].map(pd.Series(ids.to_numpy(), index=newdeals.index)).astype('int32')
+    newdeals.index = pd.Index(ids.to_numpy(), name=deals.index.name)
+
+    tables['lenders'] = fact_table(pd.concat([lenders[~affected], added], ignore_index=True))
+    tables['deals'] = pd.concat([deals[~deals[key].isin(delta[key])], newdeals]).sort_index()
+    for col in tables['deals'].columns:
+        if isinstance(deals[col].dtype, pd.CategoricalDtype):
+            tables['deals'][col] = tables['deals'][col].astype('category')
+    for name, dims in CUBES.items():
+        tables[name] = update_cube(tables[name], removed, added, dims)
+
+    previous = dict(manifest)
+    manifest = dict(manifest, version=manifest['version'] + 1,
+                    next_deal_id=manifest['next_deal_id'] + int(fresh.sum()))
+    manifest['directory'] = _new_version(store_dir, manifest['version'])
+    manifest['deltas'] = manifest['deltas'] + [{'file': os.path.basename(path), 'sha256': digest,
+                                                'deals': int(delta[key].nunique()), 'lender rows': len(added),
+                                                'quality': quality.summary(counts)}]
+    _write(tables, manifest, store_dir, previous)
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the processed dataset store or append a deal export to it.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help='full rebuild from the source workbooks')
+    build.add_argument('--backend', choices=BACKENDS, default=BACKEND or 'pandas')
+    build.add_argument('--chunk-deals', type=int, default=CHUNK_DEALS, help='deals exploded at a time (duckdb)')
+    append = sub.add_parser('append', help='merge new or amended deals')
+    append.add_argument('delta', help='workbook shaped like deals_insto_europe.xlsx')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        manifest = build_store(backend=args.backend, chunk_deals=args.chunk_deals)
+    else:
+        manifest = apply_delta(args.delta)
+    print('store version {}'.format(manifest['version']))
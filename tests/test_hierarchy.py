@@ -0,0 +1,38 @@
+import pandas as pd
+
+from hierarchy import aggregate_path, hierarchy_figure
+
+
+def _frame():
+    return pd.DataFrame({
+        'sector': [s for s in 'ABCDEFGH' for _ in range(3)],
+        'lender': ['x', 'y', 'z'] * 8,
+        'valueEUR': [float(i + 1) for i in range(24)],
+    })
+
+
+def test_top_below_top_level_values():
+    df = _frame()
+    data = aggregate_path(df, ['sector', 'lender'], top=3)
+    sectors = data['sector'].unique().tolist()
+    assert sorted(sectors) == ['F', 'G', 'H', 'Other (5)']
+    assert data['valueEUR'].sum() == df['valueEUR'].sum()
+    assert data.loc[data['sector'] == 'Other (5)', 'lender'].isna().all()
+
+
+def test_figure_with_small_top():
+    fig = hierarchy_figure('treemap', _frame(), ['sector', 'lender'], top=1)
+    assert 'Other (7)' in list(fig.data[0].labels)
+
+
+def test_prefolded_leaves_pass_through():
+    df = _frame()
+    # What lake.top_sums() returns for top=2: the two largest lenders of each sector and the rest
+    cut = df.sort_values('valueEUR', ascending=False).groupby('sector').head(2)
+    rest = df.drop(cut.index).groupby('sector', as_index=False)['valueEUR'].sum().assign(lender='Other (1)')
+    cut = pd.concat([cut, rest], ignore_index=True)
+
+    path = ['sector', 'lender']
+    expected = aggregate_path(df, path, top=2).sort_values(path).reset_index(drop=True)
+    result = aggregate_path(cut, path, top=2).sort_values(path).reset_index(drop=True)
+    pd.testing.assert_frame_equal(result, expected)
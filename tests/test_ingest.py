@@ -0,0 +1,43 @@
+from ast import literal_eval
+
+import numpy as np
+import pandas as pd
+
+from ingest import DEAL_CATEGORIES, deal_table, parse_funding
+
+
+def test_parse_funding_matches_literal_eval():
+    cells = [
+        "[{'name': 'Bank A', 'valueEUR': 12.5}]",
+        "[{'name': \"Lender's Fund\", 'valueEUR': 3.0}, {'name': 'Plain', 'valueEUR': 1}]",
+        "[{'name': 'Quote \\' escaped', 'valueEUR': 2.0}]",
+        "[{'name': 'Back\\\\slash', 'valueEUR': 4.0}]",
+        "[{'name': 'No value', 'valueEUR': None}]",
+        "[{'name': 'Flag', 'valueEUR': 5.0, 'lead': True}]",
+        '[]',
+    ]
+    assert parse_funding(cells) == [literal_eval(cell) for cell in cells]
+
+
+def test_parse_funding_missing_cells():
+    cells = pd.Series([None, "[{'name': 'A', 'valueEUR': 1.0}]", np.nan], index=[10, 11, 12])
+    assert parse_funding(cells) == [[], [{'name': 'A', 'valueEUR': 1.0}], []]
+
+
+def test_deal_table_categories():
+    lenderdf = pd.DataFrame({
+        'Deal name': ['mixed', 'mixed', 'insto', 'bank', 'bank', 'unfunded', None],
+        'Bank / Insto': ['Bank', 'Insto', 'Insto', 'Bank', 'Insto', 'Bank', 'Insto'],
+        # The insto ticket of 'bank' is unfunded, so it stays bank only
+        'valueEUR': [10.0, 5.0, 7.0, 3.0, 0.0, 0.0, 9.0],
+    })
+    deals, key = deal_table(lenderdf)
+    deals = deals.set_index('Deal name')
+
+    assert list(deals.index) == ['mixed', 'insto', 'bank', 'unfunded']
+    assert list(deals['Deal Category'].cat.categories) == DEAL_CATEGORIES
+    assert deals['Deal Category'].tolist()[:3] == ['Mixed', 'Insto only', 'Bank only']
+    assert pd.isna(deals.loc['unfunded', 'Deal Category'])
+    assert deals.loc['mixed', ['Bank', 'Insto', 'Lenders', 'Insto lenders']].tolist() == [10.0, 5.0, 2, 1]
+    assert deals.loc['bank', 'Insto lenders'] == 1
+    assert key.tolist() == [0, 0, 1, 2, 2, 3, -1]
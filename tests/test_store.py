@@ -0,0 +1,68 @@
+import os
+
+import pandas as pd
+import pytest
+
+import store
+from cube import cube_pivot
+from synthetic import COUNTRIES_FILE, LENDERS_FILE, ROOT, make_deals
+
+
+@pytest.fixture
+def exports(tmp_path, monkeypatch):
+    # The ingest cache is relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    base = make_deals(2000, seed=1)
+    delta = make_deals(800, seed=7).iloc[:80].copy()
+    # 50 amended deals, one of them now without lenders, and 30 new ones
+    delta['Deal name'] = list(base['Deal name'].iloc[:50]) + ['New {}'.format(i) for i in range(30)]
+    delta.loc[delta.index[0], 'lendersFundingValues'] = '[]'
+    combined = pd.concat([base[~base['Deal name'].isin(delta['Deal name'])], delta], ignore_index=True)
+
+    base.to_excel('base.xlsx', index=False)
+    combined.to_excel('combined.xlsx', index=False)
+    delta.to_parquet('delta.parquet')
+    sources = {'lenders': os.path.join(ROOT, LENDERS_FILE), 'countries': os.path.join(ROOT, COUNTRIES_FILE)}
+    return dict(sources, deals='base.xlsx'), dict(sources, deals='combined.xlsx'), 'delta.parquet'
+
+
+def test_delta_matches_rebuild(exports):
+    basesources, combinedsources, delta = exports
+    store.build_store('incremental', basesources)
+    manifest = store.apply_delta(delta, 'incremental', basesources)
+    store.build_store('full', combinedsources)
+    inc, full = store.load_store('incremental'), store.load_store('full')
+
+    assert manifest['version'] == 2
+    assert store.apply_delta(delta, 'incremental', basesources)['version'] == 2
+
+    for name, dims in store.CUBES.items():
+        for agg in ['sum', 'count', 'mean']:
+            pd.testing.assert_frame_equal(cube_pivot(inc[name], dims[:2], aggfunc=agg).sort_index(),
+                                          cube_pivot(full[name], dims[:2], aggfunc=agg).sort_index(),
+                                          check_exact=False, rtol=1e-6)
+
+    perdeal = [df['lenders'].groupby('Deal name', observed=True)['valueEUR'].sum().sort_index() for df in (inc, full)]
+    pd.testing.assert_series_equal(*perdeal)
+    deals = [df['deals'].set_index('Deal name').sort_index().astype(object) for df in (inc, full)]
+    pd.testing.assert_frame_equal(*deals)
+
+
+def test_delta_deal_ids(exports):
+    basesources, _, delta = exports
+    store.build_store('incremental', basesources)
+    before = store.load_store('incremental')['deals']
+    ids = pd.Series(before.index, index=before['Deal name'].astype(str))
+    manifest = store.apply_delta(delta, 'incremental', basesources)
+    after = store.load_store('incremental')
+    deals, lenders = after['deals'], after['lenders']
+
+    # Amended deals keep their id, new ones continue after the largest
+    names = deals['Deal name'].astype(str)
+    amended = names.isin(ids.index)
+    assert (deals.index[amended] == ids[names[amended]].to_numpy()).all()
+    assert deals.index[~amended].min() > ids.max()
+    assert deals.index.is_unique and manifest['next_deal_id'] == deals.index.max() + 1
+    # Every lender row points at its own deal
+    assert (deals.loc[lenders['deal_id'], 'Deal name'].astype(str).to_numpy()
+            == lenders['Deal name'].astype(str).to_numpy()).all()